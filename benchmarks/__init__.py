@@ -0,0 +1,6 @@
+# 작업 공간 규모에 따른 주요 경로의 성능을 측정하는 벤치마크
+#
+# 사용법:
+#   python -m benchmarks.run --size small --out bench.json
+#   python -m benchmarks.run --size large --baseline bench.json
+#   python -m benchmarks.startup --out startup.json   (콜드 스타트·재실행)
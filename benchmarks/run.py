@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import random
+import pikepdf
+import db
+import openai_api
+import pdf_utils
+from components import chat_interface
+from benchmarks import workspace
+
+# 주요 경로의 실행 시간을 측정하여 JSON으로 출력합니다.
+# OpenAI 호출은 고정 응답을 돌려주는 가짜 클라이언트로 대체하므로 네트워크 없이 실행됩니다.
+
+QUESTIONS = [
+    "신규 서비스 출시 일정이 어떻게 바뀌었나요?",
+    "정부지원사업 신청 이력을 정리해 줘",
+    "재무팀 분기 예산 집행 현황",
+    "보안 점검 결과 주의 사항은?",
+]
+
+
+class _StubCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model, messages, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        text = "## 요약\n- 회의 결과 일정이 조정되었습니다.\n- 다음 회의까지 자료를 준비합니다."
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def install_stub_client(latency=0.0):
+    """공유 OpenAI 클라이언트 자리에 가짜 클라이언트를 넣습니다. (호출마다 latency초 대기)"""
+    openai_api._client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=_StubCompletions(latency)),
+        close=lambda: None,
+    )
+
+
+def make_text_pdf(texts):
+    """페이지별 텍스트(한글 포함)로 텍스트 레이어가 있는 PDF 바이트를 만듭니다.
+
+    글자 코드를 유니코드 코드 포인트 그대로 쓰는 Identity-H 폰트를 쓰고, 실제 서브셋 폰트처럼
+    사용한 글자만 ToUnicode CMap의 bfchar로 등록합니다.
+    """
+    pdf = pikepdf.new()
+    codes = sorted({ord(ch) for text in texts for ch in text if ch != "\n"})
+    lines = [b"/CIDInit /ProcSet findresource begin 12 dict begin begincmap",
+             b"1 begincodespacerange <0000> <FFFF> endcodespacerange"]
+    # bfchar 블록 하나에는 최대 100개까지 넣을 수 있습니다.
+    for i in range(0, len(codes), 100):
+        block = codes[i:i + 100]
+        lines.append(b"%d beginbfchar" % len(block))
+        lines += [b"<%04X> <%04X>" % (c, c) for c in block]
+        lines.append(b"endbfchar")
+    lines.append(b"endcmap end end")
+    cmap = pdf.make_stream(b"\n".join(lines))
+    font = pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type0, BaseFont=pikepdf.Name("/Bench"),
+        Encoding=pikepdf.Name("/Identity-H"), ToUnicode=cmap,
+    )
+    for text in texts:
+        ops = [b"BT /F1 10 Tf 40 800 Td"]
+        for line in text.split("\n"):
+            ops.append(b"<" + line.encode("utf-16-be").hex().encode() + b"> Tj 0 -12 Td")
+        ops.append(b"ET")
+        page = pikepdf.Dictionary(
+            Type=pikepdf.Name.Page, MediaBox=[0, 0, 595, 842],
+            Contents=pdf.make_stream(b"\n".join(ops)),
+            Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)),
+        )
+        pdf.pages.append(pikepdf.Page(page))
+    buf = io.BytesIO()
+    pdf.save(buf)
+    return buf.getvalue()
+
+
+def measure(fn, repeat):
+    """fn(i)를 repeat번 실행하고 실행 시간 통계를 ms 단위로 반환합니다."""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize_samples(samples)
+
+
+def summarize_samples(samples):
+    """ms 단위 측정값 리스트의 통계를 반환합니다."""
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def run_benchmarks(ws, repeat, pdf_repeat, stub_latency, seed=0):
+    rng = random.Random(seed)
+    results = {}
+    page_ids = ws["page_ids"]
+    folder_ids = ws["folder_ids"]
+    counts = {name: len(db.get_chat_messages(name)) for name in ws["chat_names"]}
+    longest_chat = max(counts, key=counts.get)
+
+    # 사이드바: 쓰기 직후(스냅샷 재생성)와 캐시 적중
+    def snapshot_cold(i):
+        db._bump_write_generation()
+        db.get_workspace_snapshot()
+    results["sidebar_snapshot_cold"] = measure(snapshot_cold, repeat)
+    results["sidebar_snapshot_warm"] = measure(lambda i: db.get_workspace_snapshot(), repeat)
+    results["get_folder_pages"] = measure(
+        lambda i: db.get_folder_pages(folder_ids[i % len(folder_ids)]), repeat
+    )
+
+    # 채팅 기록: 가장 긴 대화 전체와 화면에 보이는 첫 페이지
+    results["get_chat_messages_full"] = measure(lambda i: db.get_chat_messages(longest_chat), repeat)
+    results["get_chat_messages_page"] = measure(lambda i: db.get_chat_messages_page(longest_chat), repeat)
+
+    # 시스템 프롬프트 조립 (검색 + 예산 맞춤)
+    db.get_vector_index()
+    results["build_system_prompt"] = measure(
+        lambda i: chat_interface.build_system_prompt(QUESTIONS[i % len(QUESTIONS)]), repeat
+    )
+
+    long_answer = "\n".join(workspace.korean_sentence(rng) for _ in range(80))
+    results["highlight_important_info"] = measure(
+        lambda i: chat_interface.highlight_important_info(long_answer), repeat
+    )
+
+    # 페이지 저장 (본문 교체 + 검색 조각·벡터 재색인 + 응답 캐시 무효화)
+    bodies = [workspace.page_body(rng) for _ in range(8)]
+    results["update_page_content"] = measure(
+        lambda i: db.update_page_content(rng.choice(page_ids), bodies[i % len(bodies)]), repeat
+    )
+
+    # PDF 수집: 매번 다른 PDF(캐시 미스)와 같은 PDF 재수집(변환 캐시 적중)
+    install_stub_client(stub_latency)
+    pdfs = [
+        make_text_pdf([workspace.page_body(rng) + f"\n(벤치마크 {seed}-{i}-{p})" for p in range(4)])
+        for i in range(pdf_repeat)
+    ]
+
+    def ingest(data):
+        content = pdf_utils.convert_pdf_bytes(data, "회의록", "bench.pdf")
+        db.add_page_with_content("PDF 수집", folder_ids[0], content, "2025-01-01")
+    results["pdf_ingest"] = measure(lambda i: ingest(pdfs[i]), pdf_repeat)
+    results["pdf_ingest_cached"] = measure(lambda i: ingest(pdfs[i]), pdf_repeat)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    """기준 결과 대비 p50 비율을 {작업: 비율}로 반환합니다. (1보다 크면 느려짐)"""
+    ratios = {}
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base and base["p50_ms"] > 0:
+            ratios[name] = round(stats["p50_ms"] / base["p50_ms"], 3)
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="작업 공간 규모별 주요 경로 벤치마크")
+    parser.add_argument("--size", choices=sorted(workspace.SIZES), default="small")
+    parser.add_argument("--repeat", type=int, default=30, help="작업별 반복 횟수")
+    parser.add_argument("--pdf-repeat", type=int, default=5, help="PDF 수집 반복 횟수")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="가짜 OpenAI 호출 지연")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="결과 JSON 파일 (기본값: 표준 출력)")
+    parser.add_argument("--baseline", help="비교할 이전 결과 JSON 파일")
+    parser.add_argument("--keep", action="store_true", help="임시 DB 디렉터리를 지우지 않음")
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="docs_fairy_bench_")
+    try:
+        workspace.use_scratch_db(os.path.join(scratch, "bench.db"))
+        started = time.perf_counter()
+        ws = workspace.generate_workspace(seed=args.seed, **workspace.SIZES[args.size])
+        generate_seconds = time.perf_counter() - started
+
+        # 변환 로그(print)가 JSON 출력에 섞이지 않도록 표준 오류로 보냅니다.
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_benchmarks(
+                ws, args.repeat, args.pdf_repeat, args.stub_latency_ms / 1000, args.seed
+            )
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "sqlite": db.sqlite3.sqlite_version,
+                "platform": platform.platform(),
+            },
+            "workspace": {
+                "size": args.size,
+                **workspace.SIZES[args.size],
+                "seed": args.seed,
+                "generate_seconds": round(generate_seconds, 3),
+            },
+            "results": results,
+        }
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                report["baseline_p50_ratio"] = compare(report["results"], json.load(f))
+    finally:
+        openai_api._client = None
+        if args.keep:
+            print(f"임시 DB: {scratch}", file=sys.stderr)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
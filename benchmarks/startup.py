@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# 콜드 스타트(앱 모듈 import, 첫 화면 렌더링)와 재실행(rerun) 비용을 측정하여 JSON으로 출력합니다.
+#
+# 측정마다 새 파이썬 프로세스를 띄우므로 이미 불러온 모듈의 영향을 받지 않습니다. 측정용 하위 프로세스가
+# 무거운 모듈을 미리 불러오지 않도록, 이 파일의 최상위에서는 표준 라이브러리만 import합니다.
+# streamlit 자체의 import 시간은 앱과 무관하므로 측정에서 제외합니다.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# main.py가 import하는 앱 모듈
+ENTRY_MODULES = ("db", "job_worker", "metrics", "components.folder_management", "components.chat_interface")
+# 첫 화면에 필요 없는데 불러오면 시작이 느려지는 모듈
+HEAVY_MODULES = ("openai", "httpx", "tenacity", "pikepdf", "numpy", "pandas")
+
+
+def _probe_import():
+    import streamlit  # noqa: F401
+    start = time.perf_counter()
+    for name in ENTRY_MODULES:
+        __import__(name)
+    return {"ms": (time.perf_counter() - start) * 1000}
+
+
+def _probe_render(db_path, scratch, reruns):
+    import streamlit  # noqa: F401
+    from streamlit.testing.v1 import AppTest
+    import db
+    import metrics
+    db.DB_PATH = db_path
+    metrics.METRICS_PATH = os.path.join(scratch, "metrics.json")
+
+    app = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=120)
+    start = time.perf_counter()
+    app.run()
+    first = (time.perf_counter() - start) * 1000
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    samples = []
+    for _ in range(reruns):
+        # AppTest는 segmented_control의 단일 선택 값을 목록으로 다시 넣어야 재실행할 수 있습니다.
+        for group in app.get("button_group"):
+            if isinstance(group.value, str):
+                group.set_value([group.value])
+        start = time.perf_counter()
+        app.run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"first_ms": first, "rerun_ms": samples}
+
+
+def _run_probe(args):
+    """하위 프로세스에서 측정을 한 번 실행하고 결과 딕셔너리와 불러온 무거운 모듈 목록을 반환합니다."""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--probe", *args],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True,
+    ).stdout
+    # 앱이 출력한 로그 뒤 마지막 줄이 측정 결과입니다.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def probe_main(argv):
+    kind = argv[0]
+    # 앱 로그가 결과 JSON 줄과 섞이지 않도록 표준 오류로 보냅니다.
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        if kind == "import":
+            result = _probe_import()
+        else:
+            result = _probe_render(argv[1], argv[2], int(argv[3]))
+    finally:
+        sys.stdout = stdout
+    result["loaded"] = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(json.dumps(result))
+
+
+def main(argv=None):
+    from benchmarks import run, workspace
+    import db
+
+    parser = argparse.ArgumentParser(description="앱 콜드 스타트·재실행 벤치마크")
+    parser.add_argument("--size", choices=sorted(workspace.SIZES), default="small")
+    parser.add_argument("--repeat", type=int, default=5, help="콜드 스타트 측정 횟수 (회마다 새 프로세스)")
+    parser.add_argument("--reruns", type=int, default=20, help="프로세스당 재실행 측정 횟수")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="결과 JSON 파일 (기본값: 표준 출력)")
+    parser.add_argument("--baseline", help="비교할 이전 결과 JSON 파일")
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="docs_fairy_startup_")
+    try:
+        db_path = os.path.join(scratch, "bench.db")
+        workspace.use_scratch_db(db_path)
+        workspace.generate_workspace(seed=args.seed, **workspace.SIZES[args.size])
+        # 생성하면서 쌓인 요약 작업이 측정 중에 워커에서 실행되지 않도록 비웁니다.
+        with db.transaction(affects_workspace=False) as conn:
+            conn.execute("DELETE FROM jobs")
+
+        imports = [_run_probe(["import"]) for _ in range(args.repeat)]
+        renders = [
+            _run_probe(["render", db_path, scratch, str(args.reruns)]) for _ in range(args.repeat)
+        ]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": run._git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+        },
+        "workspace": {"size": args.size, **workspace.SIZES[args.size], "seed": args.seed},
+        "results": {
+            "import_entry_modules": run.summarize_samples([p["ms"] for p in imports]),
+            "first_render": run.summarize_samples([p["first_ms"] for p in renders]),
+            "rerun": run.summarize_samples([ms for p in renders for ms in p["rerun_ms"]]),
+        },
+        "heavy_modules_loaded": {
+            "import": imports[0]["loaded"],
+            "first_render": renders[0]["loaded"],
+        },
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["baseline_p50_ratio"] = run.compare(report["results"], json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--probe"]:
+        probe_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,86 @@
+import random
+import db
+
+# 벤치마크용 가상 작업 공간(폴더·페이지·대화)을 임시 DB에 생성합니다.
+
+SIZES = {
+    "small": {"folders": 10, "pages_per_folder": 10, "chats": 5, "messages": 1_000},
+    "medium": {"folders": 50, "pages_per_folder": 40, "chats": 20, "messages": 20_000},
+    "large": {"folders": 100, "pages_per_folder": 100, "chats": 50, "messages": 100_000},
+}
+
+_SUBJECTS = ["마케팅팀", "개발팀", "재무팀", "영업본부", "기획실", "인사팀", "고객지원팀", "경영진"]
+_TOPICS = [
+    "신규 서비스 출시 일정", "분기 예산 집행", "정부지원사업 신청", "채용 계획", "고객 불만 대응",
+    "서버 이전 작업", "협력사 계약 갱신", "보안 점검 결과", "매출 목표", "제품 로드맵",
+]
+_PREDICATES = [
+    "을 검토한 결과 일정이 2주 지연될 것으로 예상됩니다",
+    "에 대해 추가 자료를 다음 회의까지 준비하기로 했습니다",
+    "의 담당자를 변경하고 주간 보고를 진행하기로 결정했습니다",
+    "관련 비용이 전년 대비 {pct}% 증가하여 재검토가 필요합니다",
+    "은 {date}까지 완료하는 것을 목표로 합니다",
+    "에 대한 주의 사항을 전 직원에게 공유해야 합니다",
+]
+
+
+def _date(rng):
+    return f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def korean_sentence(rng):
+    predicate = rng.choice(_PREDICATES).format(pct=rng.randint(3, 40), date=_date(rng))
+    return f"{rng.choice(_SUBJECTS)}은 {rng.choice(_TOPICS)}{predicate}."
+
+
+def page_body(rng, paragraphs=6):
+    """회의록 형식의 한국어 본문을 만듭니다. (문단당 3~6문장)"""
+    parts = [f"# {rng.choice(_TOPICS)} 회의록", f"- 일시: {_date(rng)}"]
+    for _ in range(paragraphs):
+        parts.append(" ".join(korean_sentence(rng) for _ in range(rng.randint(3, 6))))
+    return "\n\n".join(parts)
+
+
+def use_scratch_db(path):
+    """이후 db 호출이 path의 DB를 사용하도록 바꾸고 스키마를 만듭니다."""
+    db.DB_PATH = path
+    db.initialize_db()
+
+
+def generate_workspace(folders, pages_per_folder, chats, messages, seed=0):
+    """현재 DB_PATH에 가상 작업 공간을 생성하고 생성한 id 목록을 반환합니다."""
+    rng = random.Random(seed)
+    folder_ids = []
+    page_ids = []
+    for f in range(folders):
+        folder_name = f"{rng.choice(_SUBJECTS)} {f + 1:04d}"
+        db.add_folder(folder_name)
+        folder_id = db.get_db_connection().execute(
+            "SELECT id FROM folders WHERE folder_name = ?", (folder_name,)
+        ).fetchone()['id']
+        folder_ids.append(folder_id)
+        page_ids += db.add_pages_with_content(folder_id, [
+            (f"{rng.choice(_TOPICS)} {p + 1}", page_body(rng, rng.randint(3, 10)), _date(rng))
+            for p in range(pages_per_folder)
+        ])
+
+    chat_names = [f"대화 {c + 1}" for c in range(chats)]
+    # 대화마다 메시지 수를 다르게 하여 긴 대화와 짧은 대화가 섞이도록 합니다.
+    weights = [rng.random() ** 2 + 0.05 for _ in chat_names]
+    with db.transaction():
+        for name in chat_names:
+            db.add_chat(name)
+        for i in range(messages):
+            name = rng.choices(chat_names, weights)[0]
+            if i % 2 == 0:
+                db.add_message(name, "user", f"{rng.choice(_TOPICS)} 관련해서 정리해 줘")
+            else:
+                pid = rng.choice(page_ids) if page_ids else 0
+                db.add_message(
+                    name, "assistant",
+                    f"## 요약\n{korean_sentence(rng)}\n\n참고: [{rng.choice(_TOPICS)}](page://{pid})"
+                )
+
+    # 벡터 색인은 커밋 후 별도 스레드에서 갱신되므로, 측정이 색인 작업과 겹치지 않도록 끝날 때까지 기다립니다.
+    db.wait_for_vector_updates()
+    return {"folder_ids": folder_ids, "page_ids": page_ids, "chat_names": chat_names}
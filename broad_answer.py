@@ -0,0 +1,182 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import db
+import openai_api
+import tokens
+
+# 수십 개 페이지에 걸친 질문("참여한 정부지원사업을 모두 정리해 줘" 등)을 map-reduce로 답합니다.
+#
+# 관련 페이지를 토큰 예산 단위의 묶음으로 나눠 동시에 질의(map)하고, 묶음별 부분 답변을 하나의
+# 마크다운 답변으로 합칩니다(reduce). 전체 지연 시간은 페이지 수가 아니라 가장 느린 묶음 + 합치기 1회에
+# 비례하며, 부분 답변의 [제목](page://id) 링크는 최종 답변에 모두 남깁니다.
+
+# 검토할 최대 페이지 수와 페이지당 최대 토큰 (긴 페이지는 앞부분만 사용)
+BROAD_MAX_PAGES = 48
+BROAD_PAGE_MAX_TOKENS = 3000
+# 묶음 하나(map 요청 1회)에 넣을 문서 토큰과 동시에 보낼 요청 수
+BROAD_BATCH_TOKENS = 6000
+BROAD_MAX_WORKERS = 6
+# 부분 답변을 한 번에 합칠 수 있는 최대 토큰. 넘으면 묶어서 중간 합치기를 한 번 더 합니다.
+BROAD_REDUCE_TOKENS = 8000
+
+# map 단계에서 묶음에 관련 내용이 없을 때 돌려받는 표시
+NO_RELEVANT_CONTENT = "관련 내용 없음"
+
+MAP_PROMPT = (
+    "당신은 여러 문서를 나눠 검토하는 비서입니다. 아래 문서 묶음에서 질문과 관련된 사실만 빠짐없이 추출하십시오. "
+    "근거가 된 문서는 반드시 제목을 [제목](page://id) 형식으로 링크하고, 날짜·수치·사업명·담당자는 원문 그대로 옮기십시오. "
+    "추측하지 말고, 묶음에 질문과 관련된 내용이 하나도 없으면 \"" + NO_RELEVANT_CONTENT + "\"이라고만 답하십시오."
+)
+
+REDUCE_PROMPT = (
+    "당신은 여러 문서 묶음에서 추출한 부분 답변을 하나의 답변으로 합치는 비서입니다. "
+    "**반드시** 제목과 내용을 구분한 \"Markdown\" 형식으로 작성하고, 중복된 내용은 합치되 "
+    "부분 답변에 있는 [제목](page://id) 링크는 하나도 빠뜨리지 말고 그대로 유지하십시오. "
+    "같은 주제의 정보가 충돌하면 최신 날짜를 기준으로 정리하고 과거 내용과 무엇이 달라졌는지 설명하십시오. "
+    "정부지원사업 참여 이력이 있으면 페이지 링크와 함께 지원 자격에 대한 비판적인 검토를 포함하십시오."
+)
+
+_PAGE_LINK_RE = re.compile(r'\[([^\]]+)\]\(page://(\d+)\)')
+
+
+def select_pages(question, max_pages=BROAD_MAX_PAGES):
+    """질문과 관련된 페이지를 순위대로 최대 max_pages개 골라 [(page_id, page_name, date)]로 반환합니다.
+
+    질문에 기간이나 폴더 이름이 있으면 그 범위의 페이지에서만 고릅니다.
+    """
+    pages = {}
+    for chunk in db.rank_question_chunks(question, max_pages * 3):
+        pages.setdefault(chunk['page_id'], (chunk['page_name'], chunk['date']))
+        if len(pages) >= max_pages:
+            break
+    return [(pid, name, date) for pid, (name, date) in pages.items()]
+
+
+def _page_doc(page_id, page_name, date=None):
+    content = db.get_page_content(page_id) or ""
+    # 예산을 넘는 페이지는 추정 토큰 비율만큼 앞부분을 남깁니다.
+    cost = tokens.estimate_tokens(content)
+    if cost > BROAD_PAGE_MAX_TOKENS:
+        content = content[:len(content) * BROAD_PAGE_MAX_TOKENS // cost] + "\n…(이하 생략)"
+    header = f"■ [{page_name}](page://{page_id})"
+    if date:
+        header += f" · {date}"
+    return f"{header}\n{content}"
+
+
+def make_batches(docs, batch_tokens=BROAD_BATCH_TOKENS):
+    """문서를 순서대로 batch_tokens 안팎의 묶음으로 나눕니다. (문서 하나는 나누지 않음)"""
+    batches = []
+    batch, used = [], 0
+    for doc in docs:
+        cost = tokens.estimate_tokens(doc)
+        if batch and used + cost > batch_tokens:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(doc)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _ask(system_prompt, question, body):
+    return openai_api.get_ai_response([
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"[질문] {question}\n\n{body}"},
+    ])
+
+
+def _is_usable(partial):
+    text = partial.strip()
+    return bool(text) and not text.startswith(NO_RELEVANT_CONTENT)
+
+
+def map_batches(question, batches, system_prompt=MAP_PROMPT, max_workers=BROAD_MAX_WORKERS, on_progress=None):
+    """묶음마다 질문을 최대 max_workers개씩 동시에 보내고, 쓸 수 있는 부분 답변만 묶음 순서대로 반환합니다.
+
+    일부 묶음이 실패하면 나머지로 답하고, 모든 묶음이 실패하면 첫 오류를 다시 발생시킵니다.
+
+    Args:
+        on_progress: (선택) 묶음 하나가 끝날 때마다 호출되는 콜백 (done, total).
+                     호출한 스레드에서 실행되므로 Streamlit 위젯을 갱신해도 됩니다.
+    """
+    results = [None] * len(batches)
+    errors = []
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches))),
+                            thread_name_prefix="broad-map") as pool:
+        futures = {
+            pool.submit(_ask, system_prompt, question, "\n\n".join(batch)): i
+            for i, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"문서 묶음 처리 중 오류 발생: {str(e)}")
+                errors.append(e)
+            done += 1
+            if on_progress:
+                on_progress(done, len(batches))
+    if errors and len(errors) == len(batches):
+        raise errors[0]
+    return [r for r in results if r and _is_usable(r)]
+
+
+def _reduce_input(partials):
+    return "\n\n".join(f"### 부분 답변 {i}\n{text}" for i, text in enumerate(partials, start=1))
+
+
+def missing_citations(partials, answer):
+    """부분 답변에는 있지만 최종 답변에서 빠진 페이지 링크를 [(제목, page_id)]로 반환합니다."""
+    cited = {int(pid) for _, pid in _PAGE_LINK_RE.findall(answer)}
+    missing = {}
+    for partial in partials:
+        for title, pid in _PAGE_LINK_RE.findall(partial):
+            if int(pid) not in cited:
+                missing.setdefault(int(pid), title)
+    return [(title, pid) for pid, title in missing.items()]
+
+
+def stream_broad_answer(question, on_progress=None):
+    """관련 페이지 전체를 map-reduce로 검토한 답변을 조각(delta) 단위로 yield합니다.
+
+    map 단계는 on_progress(done, total)로 진행 상황을 알리고, 합치기 단계는 생성되는 대로 yield합니다.
+    합친 답변에서 빠진 인용은 끝에 "참고 문서"로 덧붙여 모든 [제목](page://id) 링크를 유지합니다.
+    """
+    pages = select_pages(question)
+    if not pages:
+        yield "관련된 문서가 없습니다."
+        return
+    batches = make_batches([_page_doc(*page) for page in pages])
+    partials = map_batches(question, batches, on_progress=on_progress)
+    if not partials:
+        yield "검토한 문서에서 질문과 관련된 내용을 찾지 못했습니다."
+        return
+
+    sources = partials
+    # 부분 답변이 한 번에 합치기엔 많으면 묶어서 중간 합치기를 먼저 합니다.
+    while len(partials) > 1 and tokens.estimate_tokens(_reduce_input(partials)) > BROAD_REDUCE_TOKENS:
+        groups = make_batches(partials, BROAD_REDUCE_TOKENS)
+        if len(groups) == len(partials):
+            break
+        merged = map_batches(question, [[_reduce_input(g)] for g in groups], system_prompt=REDUCE_PROMPT)
+        if not merged:
+            break
+        partials = merged
+
+    parts = []
+    deltas = openai_api.stream_ai_response([
+        {"role": "system", "content": REDUCE_PROMPT},
+        {"role": "user", "content": f"[질문] {question}\n\n{_reduce_input(partials)}"},
+    ])
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield delta
+    finally:
+        deltas.close()
+    missing = missing_citations(sources, "".join(parts))
+    if missing:
+        yield "\n\n#### 참고 문서\n" + "\n".join(f"- [{title}](page://{pid})" for title, pid in missing)
@@ -1,17 +1,32 @@
 import streamlit as st
-import openai_api
 import db
+import tokens
 import random
 import re
 
+SYSTEM_INSTRUCTIONS = (
+    "아래는 질문과 관련된 저장된 페이지의 내용입니다. "
+    "**반드시** 답변은 가독성이 좋게 제목, 내용등을 구분하여 \"Markdown\" 형식으로 표현합니다."
+    "문서는 질문에 내용과 일치하는 경우에만 참조해야하며, 확실하지 않은 경우 참조할 수 없습니다."
+    "답변에 문서를 인용하거나 참조할 경우, 반드시 제목을 [제목](page://id) 형식으로 링크하여 포함하십시오.\n\n"
+    "문서는 여러개를 인용 및 참조할 수 있으며, 중복된 정보가 있을 경우 모든 링크를 표시해주고, 최신 내용을 기준으로 전반적인 답변을 작성하고,"
+    "추가적으로 과거 내용과 최신 내용에서 무엇이 변경되었는지 설명하는 내용을 포함해야합니다."
+    "이에 따라 주의할 점이 있다면 주의하는 내용을 포함해 답변을 작성해야합니다."
+    "개인 문서에 있는 내용을 바탕으로 정부지원사업에 참여한 이력이 있는경우 페이지 링크를 걸어서 지원 자격에 대한 비판적인 답변을 작성해야한다."
+)
+
+def _empty_window():
+    return {"messages": [], "has_more": False}
+
+
 def initialize_chat():
-    # DB에서 채팅 탭과 메시지를 로드하여 세션 상태에 저장
+    # DB에서 채팅 탭 이름만 로드합니다. (메시지는 탭을 볼 때 load_chat_window로 불러옴)
     if 'chat_tabs' not in st.session_state:
         chats = db.get_all_chats()
         if not chats:
             db.add_chat("일반 대화")
             chats = db.get_all_chats()
-        st.session_state.chat_tabs = {name: db.get_chat_messages(name) for name in chats}
+        st.session_state.chat_tabs = {name: None for name in chats}
     if 'current_tab' not in st.session_state:
         st.session_state.current_tab = list(st.session_state.chat_tabs.keys())[0]
 
@@ -27,10 +42,101 @@ def highlight_important_info(text: str) -> str:
     return text
 
 
+def split_complete_lines(text: str):
+    """텍스트를 완성된 줄(마지막 줄바꿈까지)과 아직 이어지는 나머지로 나눕니다."""
+    cut = text.rfind("\n") + 1
+    return text[:cut], text[cut:]
+
+
+def build_context_docs(question, top_k=db.RETRIEVAL_TOP_K, token_budget=db.RETRIEVAL_TOKEN_BUDGET):
+    """질문과 관련된 페이지를 프롬프트용 문서 목록으로 만듭니다.
+
+    가장 관련 높은 CONTEXT_FULL_TEXT_PAGES개 페이지는 본문 조각을 넣고, 그다음 CONTEXT_SUMMARY_PAGES개는
+    미리 만들어 둔 요약만 넣어(요약이 아직 없으면 가장 관련 높은 조각 하나) 적은 토큰으로 폭넓게 참조합니다.
+    수정된 적이 있는 상위 페이지는 마지막 수정의 diff를 덧붙여, 모델이 과거와 최신 내용의 차이를 설명할 수 있게 합니다.
+    질문에 기간이나 폴더 이름이 있으면 그 범위의 페이지에서만 고르고, 문서 제목 옆에 기록 날짜를 붙입니다.
+    """
+    changes_budget = int(token_budget * tokens.CHANGES_BUDGET_RATIO)
+    summaries_budget = int(token_budget * tokens.SUMMARIES_BUDGET_RATIO)
+    full_budget = token_budget - changes_budget - summaries_budget
+
+    # 순위 순으로 페이지별 조각을 묶습니다.
+    ranked = {}
+    for chunk in db.rank_question_chunks(question, max(top_k, db.CONTEXT_SUMMARY_PAGES * 2)):
+        header = f"■ [{chunk['page_name']}](page://{chunk['page_id']})"
+        if chunk['date']:
+            header += f" · {chunk['date']}"
+        page = ranked.setdefault(chunk['page_id'], {"header": header, "bodies": []})
+        page["bodies"].append(chunk['body'])
+    if not ranked:
+        return ["(관련된 문서가 없습니다.)"]
+    page_ids = list(ranked)
+    full_ids = page_ids[:db.CONTEXT_FULL_TEXT_PAGES]
+    summary_ids = page_ids[db.CONTEXT_FULL_TEXT_PAGES:db.CONTEXT_FULL_TEXT_PAGES + db.CONTEXT_SUMMARY_PAGES]
+
+    docs = []
+    changes = db.get_latest_page_changes(full_ids)
+    for pid in full_ids:
+        bodies = []
+        for body in ranked[pid]["bodies"]:
+            cost = tokens.estimate_tokens(body)
+            if cost <= full_budget:
+                bodies.append(body)
+                full_budget -= cost
+        if not bodies:
+            continue
+        doc = ranked[pid]["header"] + "\n" + "\n…\n".join(bodies)
+        change = changes.get(pid)
+        if change and change['diff']:
+            section = f"\n\n[최근 수정 내용 (리비전 {change['from_revision']} → {change['to_revision']})]\n{change['diff']}"
+            cost = tokens.estimate_tokens(section)
+            if cost <= changes_budget:
+                doc += section
+                changes_budget -= cost
+        docs.append(doc)
+
+    summaries = db.get_page_summaries(summary_ids)
+    for pid in summary_ids:
+        text = summaries.get(pid)
+        label = "요약" if text else "발췌"
+        section = f"{ranked[pid]['header']} ({label})\n{text or ranked[pid]['bodies'][0]}"
+        cost = tokens.estimate_tokens(section)
+        if cost <= summaries_budget:
+            docs.append(section)
+            summaries_budget -= cost
+    return docs or ["(관련된 문서가 없습니다.)"]
+
+
+def build_system_prompt(question):
+    """지침과 문서 예산 안에서 고른 관련 페이지 조각으로 시스템 메시지를 만듭니다."""
+    docs_budget, _ = tokens.split_budget(tokens.estimate_tokens(SYSTEM_INSTRUCTIONS))
+    docs = build_context_docs(question, token_budget=docs_budget)
+    return SYSTEM_INSTRUCTIONS + "\n\n" + "\n\n".join(docs)
+
+
+def load_chat_window(tab_name):
+    """탭의 메시지 창(최신 CHAT_PAGE_SIZE개)을 처음 볼 때만 DB에서 불러옵니다."""
+    window = st.session_state.chat_tabs.get(tab_name)
+    if window is None:
+        messages, has_more = db.get_chat_messages_page(tab_name)
+        window = {"messages": messages, "has_more": has_more}
+        st.session_state.chat_tabs[tab_name] = window
+    return window
+
+
+def load_older_messages(tab_name):
+    """창의 가장 오래된 메시지 id 이전 페이지를 불러와 앞에 붙입니다."""
+    window = load_chat_window(tab_name)
+    before_id = window["messages"][0]["id"] if window["messages"] else None
+    older, has_more = db.get_chat_messages_page(tab_name, before_id=before_id)
+    window["messages"] = older + window["messages"]
+    window["has_more"] = has_more
+
+
 def add_new_chat():
     new_name = f"새 대화 {len(st.session_state.chat_tabs) + 1}"
     if db.add_chat(new_name):
-        st.session_state.chat_tabs[new_name] = []
+        st.session_state.chat_tabs[new_name] = _empty_window()
         st.session_state.current_tab = new_name
 
 
@@ -43,7 +149,7 @@ def delete_chat(tab_name: str):
                 st.session_state.current_tab = rem[0]
             else:
                 db.add_chat("일반 대화")
-                st.session_state.chat_tabs = {"일반 대화": []}
+                st.session_state.chat_tabs = {"일반 대화": _empty_window()}
                 st.session_state.current_tab = "일반 대화"
 
 
@@ -71,63 +177,100 @@ def render_chat_interface():
             delete_chat(st.session_state.current_tab)
             st.rerun()
 
+    # 선택한 대화 탭 하나만 렌더링합니다. (다른 탭의 메시지는 불러오지도 그리지도 않음)
     all_tabs = list(st.session_state.chat_tabs.keys())
-    tabs = st.tabs(all_tabs)
-    for tab_c, tab_name in zip(tabs, all_tabs):
-        with tab_c:
-            st.session_state.current_tab = tab_name
-            messages = st.session_state.chat_tabs[tab_name]
-
-            for idx, msg in enumerate(messages):
-                st.chat_message(msg["role"]).markdown(msg["content"], unsafe_allow_html=True)
-                if msg["role"] == "assistant":
-                    refs = re.findall(r'\[([^\]]+)\]\(page://(\d+)\)', msg["content"])
-                    if refs:
-                        for title, pid in refs:
-                            # 버튼 하나당 한 줄씩 세로로 출력됩니다.
-                            if st.button(f"🔗 {title} 바로가기", key=f"nav_{tab_name}_{idx}_{pid}"):
-                                selected_id = int(pid)
-                                st.session_state.selected_page_id = selected_id
-                                page = db.get_page(selected_id)
-                                st.session_state.selected_folder_id = page['folder_id']
-                                st.rerun()
-
-            user_input = st.chat_input("메시지를 입력하세요…", key=f"input_{tab_name}")
-            if not user_input:
-                continue
-
-            messages.append({"role": "user", "content": user_input})
-            db.add_message(tab_name, "user", user_input)
-
-            # 시스템 메시지: 페이지 내용과 형식 지침 포함
-            page_records = []
-            for f in db.get_all_folders():
-                page_records.extend(db.get_folder_pages(f['id']))
-            docs = []
-            for p in page_records:
-                name = p['page_name']
-                content = p['content'].strip() or "(내용 없음)"
-                docs.append(f"■ [{name}](page://{p['id']})\n{content}")
-            system_prompt = (
-                "아래는 저장된 페이지 목록 및 내용입니다. "
-                "**반드시** 답변은 가독성이 좋게 제목, 내용등을 구분하여 \"Markdown\" 형식으로 표현합니다."
-                "문서는 질문에 내용과 일치하는 경우에만 참조해야하며, 확실하지 않은 경우 참조할 수 없습니다."
-                "답변에 문서를 인용하거나 참조할 경우, 반드시 제목을 [제목](page://id) 형식으로 링크하여 포함하십시오.\n\n"
-                "문서는 여러개를 인용 및 참조할 수 있으며, 중복된 정보가 있을 경우 모든 링크를 표시해주고, 최신 내용을 기준으로 전반적인 답변을 작성하고,"
-                "추가적으로 과거 내용과 최신 내용에서 무엇이 변경되었는지 설명하는 내용을 포함해야합니다."
-                "이에 따라 주의할 점이 있다면 주의하는 내용을 포함해 답변을 작성해야합니다."
-                "개인 문서에 있는 내용을 바탕으로 정부지원사업에 참여한 이력이 있는경우 페이지 링크를 걸어서 지원 자격에 대한 비판적인 답변을 작성해야한다."
-                + "\n\n".join(docs)
-            )
-
-            payload = [{"role": "system", "content": system_prompt}]
-            payload += [{"role": m["role"], "content": m["content"]} for m in messages]
-
-            with st.spinner("AI가 응답 중입니다..."):
-                ai_text = openai_api.get_ai_response(payload)
-                ai_text = highlight_important_info(ai_text)
-
-            messages.append({"role": "assistant", "content": ai_text})
-            db.add_message(tab_name, "assistant", ai_text)
-            st.session_state.chat_tabs[tab_name] = messages
-            st.rerun()
+    if st.session_state.current_tab not in all_tabs:
+        st.session_state.current_tab = all_tabs[0]
+    selected = st.segmented_control(
+        "대화", all_tabs, default=st.session_state.current_tab, label_visibility="collapsed"
+    )
+    tab_name = st.session_state.current_tab = selected or st.session_state.current_tab
+
+    window = load_chat_window(tab_name)
+    messages = window["messages"]
+
+    if window["has_more"] and st.button("⬆ 이전 메시지 더 보기", key=f"older_{tab_name}"):
+        load_older_messages(tab_name)
+        st.rerun()
+
+    # 답변의 페이지 링크는 저장할 때 message_refs에 추출해 두었으므로 한 번의 조회로 가져옵니다.
+    refs_by_message = db.get_message_refs(m["id"] for m in messages if m["role"] == "assistant")
+    for msg in messages:
+        st.chat_message(msg["role"]).markdown(msg["content"], unsafe_allow_html=True)
+        for title, pid in refs_by_message.get(msg["id"], []):
+            # 버튼 하나당 한 줄씩 세로로 출력됩니다.
+            if st.button(f"🔗 {title} 바로가기", key=f"nav_{tab_name}_{msg['id']}_{pid}"):
+                st.session_state.selected_page_id = pid
+                page = db.get_page(pid, with_content=False)
+                st.session_state.selected_folder_id = page['folder_id']
+                st.rerun()
+
+    # 관련 문서가 많은 질문은 문서를 묶음으로 나눠 동시에 검토한 뒤 하나의 답변으로 합칩니다.
+    broad = st.toggle(
+        "📚 전체 문서 검토", key=f"broad_{tab_name}",
+        help="관련된 페이지를 모두 나눠 읽고 답합니다. 여러 문서를 정리하는 질문에 적합합니다."
+    )
+    user_input = st.chat_input("메시지를 입력하세요…", key=f"input_{tab_name}")
+    if not user_input:
+        return
+
+    # openai SDK를 쓰는 모듈은 첫 질문을 보낼 때 불러옵니다. (페이지만 둘러볼 때는 로드하지 않음)
+    import openai
+    import openai_api
+    import conversation
+    import broad_answer
+
+    # 질문 저장은 쓰기 스레드에 맡기고, 커밋되는 동안 관련 페이지 검색을 먼저 진행합니다.
+    saved = db.add_message_async(tab_name, "user", user_input)
+
+    # 시스템 메시지: 지침 + 문서 예산 안에서 고른 관련 페이지 조각
+    system_prompt = None if broad else build_system_prompt(user_input)
+
+    # 대화 기록은 DB에서 읽으므로 질문이 커밋된 뒤에 조립합니다.
+    messages.append({"id": saved.result(), "role": "user", "content": user_input})
+
+    st.chat_message("user").markdown(user_input)
+    box = st.chat_message("assistant").empty()
+    # 중지 버튼을 누르면 Streamlit이 스크립트를 재실행하면서 아래 루프가 중단됩니다.
+    st.button("⏹ 응답 중지", key=f"stop_{tab_name}")
+
+    if broad:
+        box.markdown("📚 관련 문서를 나눠 검토하는 중…")
+        deltas = broad_answer.stream_broad_answer(
+            user_input,
+            on_progress=lambda done, total: box.markdown(f"📚 문서 묶음 {done}/{total}개 검토 완료…")
+        )
+    else:
+        # 남은 예산은 대화 기록에 사용 (넘치는 오래된 턴은 누적 요약으로 압축)
+        history_budget = tokens.REQUEST_TOKEN_BUDGET - tokens.estimate_tokens(system_prompt)
+        payload = [{"role": "system", "content": system_prompt}]
+        payload += conversation.build_history(tab_name, history_budget)
+        deltas = openai_api.stream_ai_response(payload)
+
+    # 완성된 줄만 하이라이트하여 누적하고, 미완성 줄은 그대로 뒤에 붙여 표시합니다.
+    shown, pending = "", ""
+    finished = False
+    error = None
+    try:
+        for delta in deltas:
+            complete, pending = split_complete_lines(pending + delta)
+            if complete:
+                shown += highlight_important_info(complete)
+            box.markdown(shown + pending + "▌", unsafe_allow_html=True)
+        finished = True
+    except openai.OpenAIError as e:
+        error = e
+    finally:
+        deltas.close()
+        ai_text = shown + highlight_important_info(pending)
+        # 완료·중단 어느 쪽이든 최종 메시지는 한 번만 저장합니다.
+        # 재시도 후에도 실패해 받은 내용이 없으면 오류 문구를 답변으로 저장하지 않습니다.
+        if ai_text or error is None:
+            if not finished:
+                ai_text += "\n\n_(응답 생성이 중단되었습니다.)_"
+            message_id = db.add_message(tab_name, "assistant", ai_text)
+            messages.append({"id": message_id, "role": "assistant", "content": ai_text})
+    if error is not None and not ai_text:
+        box.error(f"AI 응답을 받지 못했습니다. 잠시 후 다시 시도해 주세요. ({type(error).__name__})")
+        return
+    st.rerun()
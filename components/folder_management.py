@@ -1,6 +1,8 @@
+import os
+import time
 import streamlit as st
 import db
-import pdf_utils
+import job_worker
 from datetime import date
 
 
@@ -35,8 +37,10 @@ def render_sidebar():
                     st.error("동일한 이름의 폴더가 있습니다.")
                 st.rerun()
 
-    # 폴더 및 페이지 목록
-    folders = db.get_all_folders()
+    # 폴더 및 페이지 목록 (쓰기가 없으면 프로세스 공유 스냅샷을 그대로 사용)
+    snapshot = db.get_workspace_snapshot()
+    folders = snapshot['folders']
+    jobs_by_folder = db.get_jobs_by_folder()
     if 'expanded_folders' not in st.session_state:
         st.session_state.expanded_folders = {}
 
@@ -49,7 +53,9 @@ def render_sidebar():
 
         with st.sidebar.expander(f"📁 {fname}", expanded=st.session_state.expanded_folders[fid]):
             st.session_state.expanded_folders[fid] = True
-            pages = db.get_folder_pages(fid)
+            pages = snapshot['pages_by_folder'].get(fid, [])
+
+            render_job_status(fid, jobs_by_folder.get(fid, []))
 
             if not pages:
                 st.info("페이지가 없습니다. 아래에서 새 페이지를 추가하세요.")
@@ -100,32 +106,36 @@ def render_sidebar():
                     ("문서", "회의록"),
                     key=f"new_page_type_{fid}"
                 )
-                # PDF 업로드 기능
-                uploaded_pdf = st.file_uploader(
+                # PDF 업로드 기능 (여러 파일을 올리면 동시에 변환)
+                uploaded_pdfs = st.file_uploader(
                     "(선택) PDF 업로드하여 회의록 생성",
                     type=["pdf"],
+                    accept_multiple_files=True,
                     key=f"pdf_upload_{fid}",
-                    help="PDF 파일을 업로드하면 AI가 회의록 형식으로 내용을 채워줍니다."
+                    help="PDF 파일을 업로드하면 AI가 회의록 형식으로 내용을 채워줍니다. "
+                         "여러 파일을 올리면 파일마다 페이지가 생성됩니다."
                 )
 
                 submit_button = st.form_submit_button("추가", use_container_width=True)
 
                 if submit_button:
-                    if not new_page_name:
+                    if not new_page_name and len(uploaded_pdfs) <= 1:
                         st.error("페이지 이름을 입력해주세요.")
-                    elif uploaded_pdf:
-                        # PDF 파일이 있으면 회의록 생성
-                        with st.spinner("AI가 PDF를 분석하여 페이지를 생성 중입니다..."):
-                            date_str = selected_date.isoformat()
-                            meeting_notes = pdf_utils.process_pdf_to_meeting_notes(uploaded_pdf, docs_type)
-                            page_id = db.add_page_with_content(new_page_name, fid, meeting_notes, date_str)
-                            if page_id:
-                                st.session_state.selected_page_id = page_id
-                                st.session_state.selected_folder_id = fid
-                                st.success(f"'{new_page_name}' 페이지가 생성되었습니다.")
-                                st.rerun()
+                    elif uploaded_pdfs:
+                        # PDF 변환은 백그라운드 작업 대기열에서 처리 (새로고침해도 작업이 유지됨)
+                        date_str = selected_date.isoformat()
+                        for f in uploaded_pdfs:
+                            if len(uploaded_pdfs) == 1:
+                                page_name = new_page_name
                             else:
-                                st.error("회의록 생성 중 오류가 발생했습니다.")
+                                stem = os.path.splitext(f.name)[0]
+                                page_name = f"{new_page_name} - {stem}" if new_page_name else stem
+                            job_worker.enqueue_pdf_ingest(
+                                fid, page_name, date_str, docs_type, f.name, bytes(f.getbuffer())
+                            )
+                        st.success(f"{len(uploaded_pdfs)}개 PDF가 변환 대기열에 추가되었습니다.")
+                        # 작업 상태 표시는 이번 실행에서 이미 이전 목록으로 그려졌으므로 다시 실행해 새 작업을 폴링합니다.
+                        st.rerun()
                     else:
                         # PDF 파일이 없으면 빈 페이지 생성
                         page_id = db.add_page_with_content(new_page_name, fid, "")
@@ -138,6 +148,42 @@ def render_sidebar():
                             st.error("페이지 추가 중 오류가 발생했습니다.")
 
 
+JOB_STATUS_LABELS = {
+    "queued": "⏳ 대기 중",
+    "running": "⚙️ 변환 중",
+    "done": "✅ 완료",
+    "failed": "❌ 실패",
+}
+
+
+def render_job_status(fid, jobs):
+    """폴더의 PDF 변환 작업 상태를 표시합니다.
+
+    jobs는 사이드바가 모든 폴더에 대해 한 번에 읽은 이 폴더의 작업 목록입니다.
+    진행 중인 작업이 있으면 이 부분만 주기적으로 다시 그리며(fragment),
+    작업이 끝나면 페이지 목록을 갱신하기 위해 앱 전체를 다시 실행합니다.
+    """
+    active = {j['id'] for j in jobs if j['status'] in ("queued", "running")}
+
+    @st.fragment(run_every=2 if active else None)
+    def job_status():
+        # 폴링 중인 폴더만 다시 조회합니다. (그 외에는 이번 실행에서 읽은 목록을 그대로 사용)
+        current = db.get_folder_jobs(fid) if active else jobs
+        still_active = {j['id'] for j in current if j['status'] in ("queued", "running")}
+        if active - still_active:
+            st.rerun(scope="app")
+        for job in current:
+            label = JOB_STATUS_LABELS.get(job['status'], job['status'])
+            line = f"{label} · {job['params'].get('filename', '')}"
+            if job['status'] == "failed" and job['error']:
+                line += f" ({job['error']})"
+            elif job['status'] == "queued" and job['attempts']:
+                line += f" (재시도 {job['attempts']}회)"
+            st.caption(line)
+
+    job_status()
+
+
 def render_page_detail():
     """메인 영역: 선택된 페이지의 상세 내용을 렌더링합니다."""
     pid = st.session_state.selected_page_id
@@ -145,7 +191,7 @@ def render_page_detail():
 
     # 폴더명 찾기
     folder_id = st.session_state.selected_folder_id
-    folders = db.get_all_folders()
+    folders = db.get_workspace_snapshot()['folders']
     folder_name = next((f['folder_name'] for f in folders if f['id'] == folder_id), "")
 
     # 상단 네비게이션 바
@@ -182,6 +228,18 @@ def render_page_detail():
             db.update_page_content(pid, content)
             st.success("저장되었습니다.")
 
+    # 수정 이력 (선택한 리비전과 최신 내용 비교)
+    revisions = db.get_page_revisions(pid)
+    if len(revisions) > 1:
+        with st.expander(f"📜 수정 이력 ({len(revisions)}개 리비전)"):
+            labels = {
+                r['revision']: f"리비전 {r['revision']} · "
+                + (time.strftime("%Y-%m-%d %H:%M", time.localtime(r['created_at'])) if r['created_at'] else "최초 본문")
+                for r in revisions[:-1]
+            }
+            base = st.selectbox("비교할 리비전", list(reversed(labels)), format_func=labels.get)
+            st.code(db.diff_page_revisions(pid, base) or "(변경 없음)", language="diff")
+
     # 날짜 변경 폼
     with st.form(key="edit_date_form", clear_on_submit=False):
         new_date = st.date_input(
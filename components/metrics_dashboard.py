@@ -0,0 +1,34 @@
+import streamlit as st
+import metrics
+
+
+def render_metrics_dashboard():
+    """작업별 실행 시간(p50/p95)과 토큰·데이터 사용량을 보여주는 관리자 화면 (?admin=metrics)"""
+    st.title("📈 성능 지표")
+    st.caption(f"최근 {metrics.RING_SIZE}건의 측정값 기준입니다. 주기적으로 {metrics.METRICS_PATH}에 저장됩니다.")
+
+    rows = metrics.summarize()
+    if not rows:
+        st.info("아직 기록된 측정값이 없습니다.")
+        return
+
+    keyword = st.text_input("작업 이름 필터", placeholder="예: db., openai., pdf.")
+    if keyword:
+        rows = [r for r in rows if keyword in r["op"]]
+
+    sort_key = st.radio("정렬", ["count", "p95_ms", "total_ms"], horizontal=True)
+    rows = sorted(rows, key=lambda r: r[sort_key], reverse=True)
+
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    col_refresh, col_export = st.columns(2)
+    with col_refresh:
+        if st.button("🔄 새로고침"):
+            st.rerun()
+    with col_export:
+        st.download_button(
+            "⬇️ Prometheus 형식 내보내기",
+            data=metrics.prometheus_text(),
+            file_name="metrics.prom",
+            mime="text/plain",
+        )
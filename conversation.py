@@ -0,0 +1,79 @@
+import openai
+import db
+import openai_api
+import tokens
+
+# 대화 기록을 토큰 예산에 맞추고, 넘치는 오래된 턴은 DB에 저장되는 누적 요약으로 압축합니다.
+
+# 압축할 때 최근 대화를 예산의 이 비율까지 줄여, 매 턴마다 요약이 다시 돌지 않도록 여유를 둡니다.
+COMPACT_TARGET_RATIO = 0.5
+# 요약 메시지 자체가 차지할 것으로 잡아두는 토큰
+SUMMARY_RESERVED_TOKENS = 800
+
+SUMMARY_PROMPT = (
+    "당신은 대화 기록을 압축하는 비서입니다. 기존 요약과 새 대화를 합쳐 하나의 요약으로 갱신하십시오. "
+    "사용자의 질문 의도, 결정된 사항, 언급된 [제목](page://id) 링크, 수치와 날짜는 반드시 보존하고, "
+    "인사말이나 반복된 내용은 제외하십시오. 한국어 개조식으로 600자 이내로 작성하십시오."
+)
+
+
+def _summary_message(summary):
+    return {"role": "system", "content": f"이전 대화 요약:\n{summary}"}
+
+
+def _tail_within(messages, budget):
+    """예산 안에 들어가는 최근 메시지들을 반환합니다. (마지막 메시지는 항상 포함)"""
+    kept = []
+    used = 0
+    for m in reversed(messages):
+        cost = tokens.estimate_message_tokens([m])
+        if kept and used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    return kept[::-1]
+
+
+def _summarize(previous_summary, messages):
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    try:
+        return openai_api.get_ai_response([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"[기존 요약]\n{previous_summary or '(없음)'}\n\n[새 대화]\n{transcript}"},
+        ])
+    except openai.OpenAIError as e:
+        print(f"대화 요약 중 오류 발생: {str(e)}")
+        return None
+
+
+def build_history(chat_name, budget):
+    """
+    토큰 예산 안에 들어가는 대화 기록 메시지를 반환합니다.
+
+    요약되지 않은 메시지만 DB에서 읽으며, 예산을 넘으면 오래된 턴을 기존 요약과 합쳐
+    다시 요약하고 chat_summaries에 저장합니다. 요약은 세션·재실행 간에 재사용되며,
+    이미 요약된 메시지는 다시 읽거나 보내지 않습니다.
+
+    Args:
+        chat_name: 대화 탭 이름
+        budget: 대화 기록에 쓸 수 있는 토큰 수
+    """
+    saved = db.get_chat_summary(chat_name)
+    summary = saved['summary'] if saved else ""
+    until = saved['summarized_until'] if saved else 0
+    recent = db.get_chat_messages(chat_name, after_id=until)
+
+    head_cost = tokens.estimate_message_tokens([_summary_message(summary)]) if summary else 0
+    if head_cost + tokens.estimate_message_tokens(recent) > budget and len(recent) > 1:
+        keep = _tail_within(recent, (budget - SUMMARY_RESERVED_TOKENS) * COMPACT_TARGET_RATIO)
+        overflow = recent[:len(recent) - len(keep)]
+        new_summary = _summarize(summary, overflow) if overflow else None
+        if new_summary:
+            summary = new_summary
+            db.save_chat_summary(chat_name, summary, overflow[-1]['id'])
+            recent = keep
+
+    head = [_summary_message(summary)] if summary else []
+    # 요약에 실패했거나 요약 후에도 넘치면 오래된 턴부터 잘라냅니다.
+    recent = _tail_within(recent, budget - tokens.estimate_message_tokens(head))
+    return head + [{"role": m["role"], "content": m["content"]} for m in recent]
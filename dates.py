@@ -0,0 +1,125 @@
+import re
+from datetime import date, timedelta
+
+# 페이지 기록 날짜(자유 입력)의 정규화와, 질문에 들어 있는 기간 표현("지난달", "최근 2주" 등)의 해석
+
+_FULL_DATE_RE = re.compile(r'(\d{4})\s*[-./년]\s*(\d{1,2})\s*[-./월]\s*(\d{1,2})\s*일?')
+_COMPACT_DATE_RE = re.compile(r'(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)')
+_YEAR_MONTH_RE = re.compile(r'(\d{4})\s*[-./년]\s*(\d{1,2})\s*월?(?![\d.])')
+_MONTH_RE = re.compile(r'(?<!\d)(\d{1,2})\s*월')
+_YEAR_RE = re.compile(r'(\d{4})\s*년')
+_RECENT_RE = re.compile(r'(?:최근|지난)\s*(\d+)\s*(일|주|개월|달|년)')
+
+
+def _valid(year, month, day):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def normalize_date(text):
+    """'2025-03-07', '2025.3.7', '2025년 3월 7일', '20250307', '2025-03' 등을 'YYYY-MM-DD'로 바꿉니다.
+
+    연·월만 있으면 그 달의 1일로 보고, 해석할 수 없으면 None을 반환합니다.
+    """
+    if not text:
+        return None
+    text = str(text).strip()
+    for pattern in (_FULL_DATE_RE, _COMPACT_DATE_RE):
+        m = pattern.search(text)
+        if m:
+            d = _valid(*m.groups())
+            return d.isoformat() if d else None
+    m = _YEAR_MONTH_RE.search(text)
+    if m:
+        d = _valid(m.group(1), m.group(2), 1)
+        return d.isoformat() if d else None
+    return None
+
+
+def _month_start(year, month):
+    # month가 범위를 벗어나면 연도를 넘깁니다. (예: 0월 → 작년 12월)
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+
+def _month_range(year, month):
+    start = _month_start(year, month)
+    return start, _month_start(year, month + 1) - timedelta(days=1)
+
+
+def _add_months(d, months):
+    start = _month_start(d.year, d.month + months)
+    last_day = (_month_start(start.year, start.month + 1) - timedelta(days=1)).day
+    return start.replace(day=min(d.day, last_day))
+
+
+def parse_date_range(question, today=None):
+    """질문의 기간 표현을 (시작일, 종료일) ISO 문자열로 반환합니다. (양 끝 포함, 기간 표현이 없으면 None)
+
+    지원: 오늘, 어제, 이번 주/지난주, 이번 달/지난달, 올해/작년, 최근·지난 N일/주/개월/년,
+    'YYYY년 M월', 'M월'(올해, 아직 오지 않은 달이면 작년), 'YYYY년', 구체적인 날짜 1~2개
+    """
+    today = today or date.today()
+    q = re.sub(r'\s+', ' ', question or "")
+
+    def result(start, end):
+        return start.isoformat(), end.isoformat()
+
+    # 구체적인 날짜가 있으면 그 날짜(2개 이상이면 그 사이)를 씁니다.
+    explicit = sorted(d for d in (
+        _valid(*m.groups()) for pattern in (_FULL_DATE_RE, _COMPACT_DATE_RE) for m in pattern.finditer(q)
+    ) if d)
+    if explicit:
+        return result(explicit[0], explicit[-1])
+
+    m = _RECENT_RE.search(q)
+    if m:
+        n, unit = int(m.group(1)), m.group(2)
+        if unit == "일":
+            start = today - timedelta(days=n)
+        elif unit == "주":
+            start = today - timedelta(weeks=n)
+        elif unit == "년":
+            start = _add_months(today, -12 * n)
+        else:
+            start = _add_months(today, -n)
+        return result(start, today)
+
+    if "오늘" in q:
+        return result(today, today)
+    if "어제" in q:
+        yesterday = today - timedelta(days=1)
+        return result(yesterday, yesterday)
+
+    monday = today - timedelta(days=today.weekday())
+    if re.search(r'(지난|저번)\s?주|전주', q):
+        return result(monday - timedelta(weeks=1), monday - timedelta(days=1))
+    if re.search(r'이번\s?주|금주', q):
+        return result(monday, monday + timedelta(days=6))
+
+    if re.search(r'(지난|저번)\s?달|전월', q):
+        return result(*_month_range(today.year, today.month - 1))
+    if re.search(r'이번\s?달|금월', q):
+        return result(*_month_range(today.year, today.month))
+
+    m = _YEAR_MONTH_RE.search(q)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return result(*_month_range(int(m.group(1)), int(m.group(2))))
+    m = _MONTH_RE.search(q)
+    if m and 1 <= int(m.group(1)) <= 12:
+        month = int(m.group(1))
+        year = today.year if month <= today.month else today.year - 1
+        return result(*_month_range(year, month))
+
+    if re.search(r'작년|지난\s?해|전년', q):
+        return result(date(today.year - 1, 1, 1), date(today.year - 1, 12, 31))
+    if re.search(r'올해|금년', q):
+        return result(date(today.year, 1, 1), date(today.year, 12, 31))
+    m = _YEAR_RE.search(q)
+    if m:
+        year = int(m.group(1))
+        return result(date(year, 1, 1), date(year, 12, 31))
+    return None
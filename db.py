@@ -1,19 +1,227 @@
 import sqlite3
+import difflib
+import hashlib
+import json
 import os
+import queue
+import re
+import time
+import threading
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date
+import dates
+import metrics
 
-def get_db_connection():
-    """데이터베이스 연결을 생성하여 반환합니다."""
-    if not os.path.exists('data'):
-        os.makedirs('data')
-    conn = sqlite3.connect('data/task_assistant.db', check_same_thread=False)
+DB_PATH = os.path.join('data', 'task_assistant.db')
+
+# 질문과 관련된 페이지 조각만 프롬프트에 넣기 위한 검색 설정
+RETRIEVAL_TOP_K = 8
+RETRIEVAL_TOKEN_BUDGET = 6000
+CHUNK_MAX_CHARS = 800
+# 프롬프트에 본문 조각을 넣는 상위 페이지 수와, 그 밖에 요약만 넣는 페이지 수
+CONTEXT_FULL_TEXT_PAGES = 2
+CONTEXT_SUMMARY_PAGES = 12
+# 검색 순위의 최신 문서 가중치: 오늘 날짜 페이지는 점수가 최대 (1 + RECENCY_WEIGHT)배가 되고,
+# 가중치는 RECENCY_HALF_LIFE_DAYS일마다 절반으로 줄어듭니다. (날짜가 없는 페이지는 가중치 없음)
+RECENCY_WEIGHT = 0.3
+RECENCY_HALF_LIFE_DAYS = 90
+# 질문에 이름이 나온 폴더의 페이지 점수 가중치 ("X 폴더"·따옴표로 명시하지 않은 폴더 이름은 범위가 아닌 가중치로만 씀)
+FOLDER_MATCH_BOOST = 0.2
+# 채팅 화면에 한 번에 불러오는 메시지 수
+CHAT_PAGE_SIZE = 30
+# 이 크기(UTF-8 바이트) 이상인 페이지 본문은 zlib으로 압축하여 저장합니다.
+PAGE_BODY_COMPRESS_MIN_BYTES = 1024
+PAGE_BODY_COMPRESS_LEVEL = 6
+# 수정 이력: 이 간격마다 전체 본문(스냅샷)을 저장하고 그 사이는 직전 리비전과의 차이만 저장합니다.
+REVISION_SNAPSHOT_INTERVAL = 10
+# 페이지당 보관하는 최대 리비전 수 (넘으면 가장 오래된 스냅샷 구간부터 삭제)
+REVISION_KEEP_MAX = 100
+# 키워드(BM25)·의미(벡터) 검색 순위를 합칠 때 쓰는 Reciprocal Rank Fusion 상수
+RRF_K = 60
+
+# 연결을 열 때 한 번만 적용하는 PRAGMA
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",          # 쓰는 동안에도 다른 세션이 읽을 수 있도록
+    "PRAGMA synchronous = NORMAL",        # WAL에서는 커밋마다 fsync하지 않아도 안전
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",       # 256MB
+    "PRAGMA cache_size = -16000",         # 약 16MB
+)
+
+_local = threading.local()
+
+def _open_connection(path):
+    data_dir = os.path.dirname(path)
+    if data_dir and not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    # isolation_level=None: 자동 커밋 모드로 두고 쓰기는 transaction()에서 명시적으로 시작합니다.
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def initialize_db():
-    """메인 테이블이 없으면 생성하고, 채팅용 테이블도 초기화합니다."""
+def get_db_connection():
+    """현재 스레드의 데이터베이스 연결을 반환합니다.
+
+    연결은 스레드마다 한 번 열어 프로세스가 끝날 때까지 재사용하므로 호출한 쪽에서 닫지 않습니다.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+@contextmanager
+def transaction(affects_workspace=True):
+    """쓰기 트랜잭션을 열고 연결을 돌려줍니다.
+
+    블록이 정상 종료되면 커밋, 예외가 나면 롤백합니다. 이미 트랜잭션 안에서
+    호출되면 바깥 트랜잭션에 합쳐집니다. BEGIN IMMEDIATE로 쓰기 잠금을 먼저 잡아
+    읽기 도중 잠금 승격 실패(database is locked)를 피합니다.
+    affects_workspace=False인 쓰기(캐시 기록 등)는 쓰기 세대를 올리지 않습니다.
+    _after_commit으로 등록한 작업은 가장 바깥 트랜잭션이 커밋된 뒤에 실행됩니다.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    _local.after_commit = []
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        _local.after_commit = []
+        raise
+    else:
+        conn.commit()
+        if affects_workspace:
+            _bump_write_generation()
+        callbacks, _local.after_commit = _local.after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"커밋 후 작업 중 오류 발생: {str(e)}")
+
+def _after_commit(callback):
+    """현재 트랜잭션이 커밋된 뒤 callback을 실행합니다. (트랜잭션 밖이면 바로 실행)
+
+    벡터 색인처럼 DB 밖에 있는 상태는 롤백될 수 있는 쓰기보다 먼저 바꾸지 않도록 여기로 미룹니다.
+    """
+    if get_db_connection().in_transaction:
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+# 커밋된 쓰기마다 1씩 증가합니다. 스냅샷은 이 값이 바뀌었을 때만 다시 읽습니다.
+_write_generation = 0
+_generation_lock = threading.Lock()
+
+def _bump_write_generation():
+    global _write_generation
+    with _generation_lock:
+        _write_generation += 1
+
+def get_write_generation():
+    """현재 쓰기 세대 번호를 반환합니다."""
+    return _write_generation
+
+# — 그룹 커밋 쓰기 — #
+# 여러 세션의 짧은 쓰기(메시지·페이지 저장)를 쓰기 전용 스레드 하나가 모아 트랜잭션 한 번으로
+# 커밋합니다. 동시에 들어온 쓰기가 잠금 대기와 커밋(fsync)을 나눠 쓰므로 동시 사용자가 늘어도
+# 쓰기 처리량이 유지됩니다. 호출한 쪽은 Future로 결과(새 id 등)를 받습니다.
 
+# 첫 쓰기가 들어온 뒤 같은 배치로 모으기 위해 기다리는 시간과, 배치 하나에 담는 최대 쓰기 수
+WRITE_BATCH_WINDOW_SECONDS = 0.003
+WRITE_BATCH_MAX = 200
+
+_write_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+def submit_write(fn, *args):
+    """fn(*args)를 쓰기 스레드에서 실행하도록 제출하고 결과의 Future를 반환합니다.
+
+    fn 안의 transaction()은 배치 트랜잭션에 합쳐지며, 쓰기마다 SAVEPOINT로 감싸 실패한 쓰기만
+    되돌립니다. Future는 배치가 커밋된 뒤에 완료됩니다. 호출한 스레드가 이미 트랜잭션 안에 있으면
+    (쓰기 잠금을 쥐고 있으므로) 쓰기 스레드를 기다리지 않고 그 트랜잭션 안에서 바로 실행합니다.
+    """
+    future = Future()
+    if get_db_connection().in_transaction:
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    _ensure_writer()
+    _write_queue.put((future, fn, args))
+    return future
+
+def _ensure_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _writer_thread.start()
+
+def _writer_loop():
+    while True:
+        batch = [_write_queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW_SECONDS
+        while len(batch) < WRITE_BATCH_MAX:
+            try:
+                batch.append(_write_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        try:
+            _run_write_batch(batch)
+        except Exception as e:
+            print(f"그룹 커밋 처리 중 오류 발생: {str(e)}")
+
+def _run_write_batch(batch):
+    """배치의 쓰기를 한 트랜잭션으로 실행하고, 커밋이 끝난 뒤 각 Future를 완료합니다."""
+    outcomes = []
+    try:
+        with metrics.span("db.write_batch") as fields, transaction() as conn:
+            fields["rows"] = len(batch)
+            for future, fn, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                pending = len(_local.after_commit)
+                conn.execute("SAVEPOINT group_write")
+                try:
+                    outcomes.append((future, fn(*args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO group_write")
+                    del _local.after_commit[pending:]
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE group_write")
+    except Exception as e:
+        # 커밋 자체가 실패하면 배치의 모든 쓰기가 되돌려집니다.
+        for future, _, _ in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for future, result, error in outcomes:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+# — 스키마 마이그레이션 — #
+# PRAGMA user_version에 적용된 마이그레이션 수를 기록합니다.
+# 스키마를 바꿀 때는 기존 마이그레이션을 고치지 말고 _MIGRATIONS 끝에 새 함수를 추가합니다.
+
+def _migration_1_base_schema(cursor):
+    """기본 스키마. 버전 관리 이전에 만들어진 DB에도 적용되도록 모두 IF NOT EXISTS로 생성합니다."""
     # folders 테이블
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS folders (
@@ -55,173 +263,1447 @@ def initialize_db():
         FOREIGN KEY (chat_name) REFERENCES chats (chat_name) ON DELETE CASCADE
     )
     ''')
+    # 오래된 대화를 압축한 누적 요약
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        chat_name TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_until INTEGER NOT NULL,
+        FOREIGN KEY (chat_name) REFERENCES chats (chat_name) ON DELETE CASCADE
+    )
+    ''')
+    _create_message_refs_table(cursor)
+
+    # LLM 응답 캐시와 응답이 참조한 페이지
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        cache_key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)"
+    )
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache_pages (
+        cache_key TEXT NOT NULL,
+        page_id INTEGER NOT NULL,
+        PRIMARY KEY (cache_key, page_id),
+        FOREIGN KEY (cache_key) REFERENCES llm_cache (cache_key) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_pages_page ON llm_cache_pages (page_id)"
+    )
 
-    conn.commit()
-    conn.close()
+    # PDF 변환 결과 캐시 (PDF 바이트 해시 + 문서 유형 + 모델 + 프롬프트 버전)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pdf_conversions (
+        pdf_sha256 TEXT NOT NULL,
+        docs_type TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (pdf_sha256, docs_type, model, prompt_version)
+    )
+    ''')
 
-def initialize_chat_db():
-    """채팅 목록과 메시지 테이블을 생성합니다."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # 백그라운드 작업 큐 (PDF 변환 등). payload에는 원본 PDF 바이트를 보관합니다.
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS chats (
+    CREATE TABLE IF NOT EXISTS jobs (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_name TEXT NOT NULL UNIQUE
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        folder_id INTEGER,
+        params TEXT NOT NULL DEFAULT '{}',
+        payload BLOB,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        next_run_at REAL NOT NULL,
+        error TEXT,
+        result_page_id INTEGER,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
     )
     ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_next ON jobs (status, next_run_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_folder ON jobs (folder_id, id)"
+    )
+
+    _create_search_tables(cursor)
+    _backfill_page_chunks(cursor)
+
+def _create_search_tables(cursor):
+    """페이지 조각 테이블과 BM25 검색용 FTS5 인덱스를 생성합니다."""
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS messages (
+    CREATE TABLE IF NOT EXISTS page_chunks (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_name TEXT NOT NULL,
+        page_id INTEGER NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        body TEXT NOT NULL,
+        FOREIGN KEY (page_id) REFERENCES pages (id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_page_chunks_page ON page_chunks (page_id)"
+    )
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS page_chunks_fts USING fts5(
+        title, body,
+        content='page_chunks', content_rowid='id',
+        tokenize='unicode61'
+    )
+    ''')
+    # page_chunks 변경 시 FTS 인덱스 동기화
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS page_chunks_ai AFTER INSERT ON page_chunks BEGIN
+        INSERT INTO page_chunks_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS page_chunks_ad AFTER DELETE ON page_chunks BEGIN
+        INSERT INTO page_chunks_fts (page_chunks_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    ''')
+    # 페이지가 삭제되면 조각도 함께 삭제
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_ad_chunks AFTER DELETE ON pages BEGIN
+        DELETE FROM page_chunks WHERE page_id = old.id;
+    END
+    ''')
+
+def _create_message_refs_table(cursor):
+    """답변 메시지가 인용한 페이지 링크 테이블을 만들고, 처음 만들 때 기존 답변에서 채웁니다."""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_refs'"
+    ).fetchone()
+    if exists:
+        return
+    cursor.execute('''
+    CREATE TABLE message_refs (
+        message_id INTEGER NOT NULL,
+        page_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (message_id, page_id),
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute('''
+    SELECT id, content FROM messages
+    WHERE role = 'assistant' AND content LIKE '%page://%'
+    ''')
+    for row in cursor.fetchall():
+        _store_message_refs(cursor, row['id'], row['content'])
+
+def _backfill_page_chunks(cursor):
+    """검색 조각이 없는 기존 페이지를 조각으로 나누어 색인합니다."""
+    cursor.execute('''
+    SELECT id, page_name, content FROM pages
+    WHERE content != '' AND id NOT IN (SELECT page_id FROM page_chunks)
+    ''')
+    for row in cursor.fetchall():
+        _index_page_chunks(cursor, row['id'], row['page_name'], row['content'])
+
+def _migration_2_page_indexes(cursor):
+    """폴더별 페이지 목록과 날짜 정렬에 쓰는 인덱스."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_folder ON pages (folder_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_date ON pages (date)")
+
+def _migration_3_messages_chat_id(cursor):
+    """messages가 대화를 이름(TEXT) 대신 chats.id 정수 외래 키로 참조하도록 테이블을 다시 만듭니다.
+
+    메시지 id는 그대로 유지하므로 chat_summaries.summarized_until과 message_refs가 계속 유효합니다.
+    """
+    # chats에 없는 이름으로 저장된 메시지도 잃지 않도록 대화를 먼저 만들어 둡니다.
+    cursor.execute("INSERT OR IGNORE INTO chats (chat_name) SELECT DISTINCT chat_name FROM messages")
+    cursor.execute('''
+    CREATE TABLE messages_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
         role TEXT NOT NULL,
         content TEXT NOT NULL,
-        FOREIGN KEY (chat_name) REFERENCES chats (chat_name) ON DELETE CASCADE
+        FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO messages_new (id, chat_id, role, content)
+    SELECT m.id, c.id, m.role, m.content
+    FROM messages m JOIN chats c ON c.chat_name = m.chat_name
+    ''')
+    cursor.execute("DROP TABLE messages")
+    cursor.execute("ALTER TABLE messages_new RENAME TO messages")
+    cursor.execute("CREATE INDEX idx_messages_chat ON messages (chat_id, id)")
+
+def _migration_4_page_bodies(cursor):
+    """페이지 본문을 page_bodies 테이블로 옮기고(큰 본문은 압축), pages에는 메타데이터만 남깁니다."""
+    cursor.execute('''
+    CREATE TABLE page_bodies (
+        page_id INTEGER PRIMARY KEY,
+        encoding TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        body BLOB NOT NULL,
+        FOREIGN KEY (page_id) REFERENCES pages (id) ON DELETE CASCADE
+    )
+    ''')
+    rows = cursor.execute("SELECT id, content FROM pages").fetchall()
+    cursor.executemany(
+        "INSERT INTO page_bodies (page_id, encoding, size, sha256, body) VALUES (?, ?, ?, ?, ?)",
+        [(r['id'], *_encode_page_body(r['content'])) for r in rows]
+    )
+    cursor.execute('''
+    CREATE TABLE pages_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        page_name TEXT NOT NULL,
+        folder_id INTEGER NOT NULL,
+        date TEXT DEFAULT '',
+        FOREIGN KEY (folder_id) REFERENCES folders (id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO pages_new (id, page_name, folder_id, date)
+    SELECT id, page_name, folder_id, date FROM pages
+    ''')
+    cursor.execute("DROP TABLE pages")
+    cursor.execute("ALTER TABLE pages_new RENAME TO pages")
+    # 테이블과 함께 삭제된 인덱스·트리거를 다시 만듭니다.
+    _migration_2_page_indexes(cursor)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_ad_chunks AFTER DELETE ON pages BEGIN
+        DELETE FROM page_chunks WHERE page_id = old.id;
+    END
+    ''')
+
+def _migration_5_page_revisions(cursor):
+    """페이지 수정 이력. body는 kind가 snapshot이면 전체 본문, delta면 직전 리비전과의 차이입니다. (둘 다 zlib)"""
+    cursor.execute('''
+    CREATE TABLE page_revisions (
+        page_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL,
+        body BLOB NOT NULL,
+        PRIMARY KEY (page_id, revision),
+        FOREIGN KEY (page_id) REFERENCES pages (id) ON DELETE CASCADE
+    )
+    ''')
+
+def _migration_6_page_summaries(cursor):
+    """페이지 요약. content_sha256이 현재 본문 해시와 같을 때만 유효하며, 기존 페이지는 요약 작업을 대기열에 넣습니다."""
+    cursor.execute('''
+    CREATE TABLE page_summaries (
+        page_id INTEGER PRIMARY KEY,
+        content_sha256 TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (page_id) REFERENCES pages (id) ON DELETE CASCADE
+    )
+    ''')
+    rows = cursor.execute("SELECT page_id FROM page_bodies WHERE size > 0").fetchall()
+    now = time.time()
+    cursor.executemany(
+        "INSERT INTO jobs (kind, params, next_run_at, created_at, updated_at) VALUES ('page_summary', ?, ?, ?, ?)",
+        [(json.dumps({"page_id": r['page_id']}), now, now, now) for r in rows]
+    )
+
+def _migration_7_page_date_norm(cursor):
+    """자유 입력 date를 'YYYY-MM-DD'로 정규화한 date_norm 열과, 기간·폴더 범위 조회용 인덱스."""
+    cursor.execute("ALTER TABLE pages ADD COLUMN date_norm TEXT")
+    rows = cursor.execute("SELECT id, date FROM pages").fetchall()
+    cursor.executemany(
+        "UPDATE pages SET date_norm = ? WHERE id = ?",
+        [(dates.normalize_date(r['date']), r['id']) for r in rows]
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_date_norm ON pages (date_norm)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_folder_date_norm ON pages (folder_id, date_norm)")
+
+def _migration_8_vector_pending(cursor):
+    """벡터 색인에 아직 반영되지 않은 페이지. 조각을 바꾼 트랜잭션에서 함께 기록하므로 프로세스가 끝나도 남습니다."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS vector_pending (
+        id INTEGER PRIMARY KEY,
+        page_id INTEGER NOT NULL
     )
     ''')
-    conn.commit()
-    conn.close()
+
+_MIGRATIONS = (
+    _migration_1_base_schema,
+    _migration_2_page_indexes,
+    _migration_3_messages_chat_id,
+    _migration_4_page_bodies,
+    _migration_5_page_revisions,
+    _migration_6_page_summaries,
+    _migration_7_page_date_norm,
+    _migration_8_vector_pending,
+)
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+def migrate(path=None):
+    """path(기본값 DB_PATH)의 DB에 아직 적용되지 않은 마이그레이션을 순서대로 적용합니다.
+
+    마이그레이션마다 별도 트랜잭션에서 실행하고 같은 트랜잭션에서 user_version을 올리므로,
+    중간에 실패해도 마지막으로 성공한 버전에서 다시 시작합니다. 여러 프로세스가 동시에 실행해도
+    쓰기 잠금을 잡은 뒤 버전을 다시 읽어 같은 마이그레이션을 두 번 적용하지 않습니다.
+
+    Returns:
+        (적용 전 버전, 적용 후 버전)
+    """
+    conn = _open_connection(path or DB_PATH)
+    try:
+        # 테이블을 다시 만드는 동안 참조 테이블의 행이 연쇄 삭제되지 않도록 외래 키 검사를 끕니다.
+        # (이 PRAGMA는 트랜잭션 밖에서만 바꿀 수 있습니다)
+        conn.execute("PRAGMA foreign_keys = OFF")
+        before = conn.execute("PRAGMA user_version").fetchone()[0]
+        if before > SCHEMA_VERSION:
+            raise RuntimeError(f"DB 스키마 버전({before})이 코드가 아는 버전({SCHEMA_VERSION})보다 높습니다.")
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    conn.commit()
+                    break
+                _MIGRATIONS[version](conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        return before, SCHEMA_VERSION
+    finally:
+        conn.close()
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+def initialize_db():
+    """DB 스키마를 최신 버전으로 맞춥니다.
+
+    Streamlit 재실행마다 호출되어도 프로세스당 DB 파일별로 한 번만 마이그레이션을 확인합니다.
+    """
+    path = DB_PATH
+    if path in _migrated_paths:
+        return
+    with _migrate_lock:
+        if path not in _migrated_paths:
+            migrate(path)
+            _migrated_paths.add(path)
+
+# — 페이지 본문 저장 (압축) — #
+
+def _encode_page_body(content):
+    """본문을 (encoding, size, sha256, body)로 변환합니다. 큰 본문만 zlib으로 압축합니다."""
+    raw = (content or "").encode("utf-8")
+    if len(raw) >= PAGE_BODY_COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw, PAGE_BODY_COMPRESS_LEVEL)
+        # 압축해도 줄지 않는 본문(이미 압축된 데이터 등)은 그대로 둡니다.
+        if len(packed) < len(raw):
+            return "zlib", len(content), hashlib.sha256(raw).hexdigest(), packed
+    return "plain", len(content or ""), hashlib.sha256(raw).hexdigest(), raw
+
+def _decode_page_body(encoding, body):
+    if body is None:
+        return ""
+    if encoding == "zlib":
+        body = zlib.decompress(body)
+    return bytes(body).decode("utf-8")
+
+def _write_page_body(conn, page_id, content):
+    conn.execute(
+        "INSERT OR REPLACE INTO page_bodies (page_id, encoding, size, sha256, body) VALUES (?, ?, ?, ?, ?)",
+        (page_id, *_encode_page_body(content))
+    )
+
+def _read_page_body(conn, page_id):
+    row = conn.execute(
+        "SELECT encoding, body FROM page_bodies WHERE page_id = ?", (page_id,)
+    ).fetchone()
+    return _decode_page_body(row['encoding'], row['body']) if row else None
+
+def get_page_content(page_id):
+    """페이지 본문만 읽어 압축을 풀어 반환합니다. (없는 페이지는 None)"""
+    return _read_page_body(get_db_connection(), page_id)
 
 # — 폴더·페이지 CRUD — #
 
 def get_all_folders():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM folders ORDER BY id")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = conn.execute("SELECT * FROM folders ORDER BY id").fetchall()
     return [dict(r) for r in rows]
 
 def add_folder(folder_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO folders (folder_name) VALUES (?)",
-            (folder_name,)
-        )
-        conn.commit()
-        result = True
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO folders (folder_name) VALUES (?)",
+                (folder_name,)
+            )
+        return True
     except sqlite3.IntegrityError:
-        result = False
-    conn.close()
-    return result
+        return False
 
 def delete_folder(folder_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        page_ids = [
+            r['id'] for r in conn.execute("SELECT id FROM pages WHERE folder_id = ?", (folder_id,))
+        ]
+        conn.execute("DELETE FROM pages WHERE folder_id = ?", (folder_id,))
+        conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+        _invalidate_cached_responses(conn, page_ids)
+        _queue_vector_update(conn, page_ids)
     return True
 
 def get_folder_pages(folder_id):
+    """폴더의 페이지 메타데이터(id, 이름, 폴더, 날짜)를 반환합니다. (본문은 읽지 않음)"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM pages WHERE folder_id = ? ORDER BY id",
+    rows = conn.execute(
+        "SELECT id, page_name, folder_id, date FROM pages WHERE folder_id = ? ORDER BY id",
         (folder_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    ).fetchall()
     return [dict(r) for r in rows]
 
-def get_page(page_id):
+def get_page(page_id, with_content=True):
+    """페이지를 반환합니다. with_content=False이면 본문을 읽거나 압축을 풀지 않습니다."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM pages WHERE id = ?", (page_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    row = conn.execute(
+        "SELECT id, page_name, folder_id, date FROM pages WHERE id = ?", (page_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    page = dict(row)
+    if with_content:
+        page['content'] = get_page_content(page_id) or ""
+    return page
 
 def add_page_with_content(page_name, folder_id, content="", date_str=""):
     """내용과 날짜를 포함한 새 페이지를 생성합니다."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO pages (page_name, folder_id, content, date) VALUES (?, ?, ?, ?)",
-        (page_name, folder_id, content, date_str)
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
+    return add_page_with_content_async(page_name, folder_id, content, date_str).result()
+
+def add_page_with_content_async(page_name, folder_id, content="", date_str=""):
+    """새 페이지 생성을 그룹 커밋으로 제출하고 새 페이지 id의 Future를 반환합니다."""
+    return submit_write(_insert_page, page_name, folder_id, content, date_str)
+
+def _insert_page(page_name, folder_id, content, date_str):
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO pages (page_name, folder_id, date, date_norm) VALUES (?, ?, ?, ?)",
+            (page_name, folder_id, date_str, dates.normalize_date(date_str))
+        )
+        new_id = cursor.lastrowid
+        _write_page_body(conn, new_id, content)
+        _enqueue_page_summary(conn, new_id, content)
+        _index_page_chunks(conn, new_id, page_name, content)
+        _queue_vector_update(conn, [new_id])
     return new_id
 
+def add_pages_with_content(folder_id, pages):
+    """여러 페이지를 한 트랜잭션으로 생성하고 새 id 리스트를 반환합니다.
+
+    Args:
+        pages: (page_name, content, date_str) 튜플 리스트
+    """
+    new_ids = []
+    with transaction() as conn:
+        for page_name, content, date_str in pages:
+            cursor = conn.execute(
+                "INSERT INTO pages (page_name, folder_id, date, date_norm) VALUES (?, ?, ?, ?)",
+                (page_name, folder_id, date_str, dates.normalize_date(date_str))
+            )
+            new_ids.append(cursor.lastrowid)
+            _write_page_body(conn, cursor.lastrowid, content)
+            _enqueue_page_summary(conn, cursor.lastrowid, content)
+            _index_page_chunks(conn, cursor.lastrowid, page_name, content)
+        _queue_vector_update(conn, new_ids)
+    return new_ids
+
 def delete_page(page_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM pages WHERE id = ?", (page_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+        _invalidate_cached_responses(conn, [page_id])
+        _queue_vector_update(conn, [page_id])
     return True
 
 def update_page_content(page_id, content):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE pages SET content = ? WHERE id = ?",
-        (content, page_id)
-    )
-    conn.commit()
-    conn.close()
+    """본문을 교체하고, 내용이 바뀌었으면 수정 이력에 새 리비전을 남깁니다."""
+    return update_page_content_async(page_id, content).result()
+
+def update_page_content_async(page_id, content):
+    """본문 교체를 그룹 커밋으로 제출하고 Future를 반환합니다."""
+    return submit_write(_replace_page_content, page_id, content)
+
+def _replace_page_content(page_id, content):
+    with transaction() as conn:
+        row = conn.execute("SELECT page_name FROM pages WHERE id = ?", (page_id,)).fetchone()
+        if row:
+            previous = _read_page_body(conn, page_id) or ""
+            if previous != content:
+                _record_page_revision(conn, page_id, previous, content)
+                _enqueue_page_summary(conn, page_id, content)
+            _write_page_body(conn, page_id, content)
+            _index_page_chunks(conn, page_id, row['page_name'], content)
+        _invalidate_cached_responses(conn, [page_id])
+        _queue_vector_update(conn, [page_id])
     return True
 
 def update_page_date(page_id, date):
     """페이지의 기록 날짜를 업데이트합니다."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE pages SET date = ? WHERE id = ?",
-        (date, page_id)
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE pages SET date = ?, date_norm = ? WHERE id = ?",
+            (date, dates.normalize_date(date), page_id)
+        )
     return True
 
+# — 페이지 요약 — #
+# 본문이 바뀌면 같은 트랜잭션에서 page_summary 작업을 대기열에 넣고, 백그라운드 워커가 요약을 만듭니다.
+# 요약은 만들 때의 본문 해시와 함께 저장되므로, 그 사이 본문이 다시 바뀌었다면 조회되지 않습니다.
+
+PAGE_SUMMARY_DELAY_SECONDS = 5.0
+
+def _enqueue_page_summary(conn, page_id, content):
+    if not content:
+        return
+    pending = conn.execute(
+        "SELECT 1 FROM jobs WHERE kind = 'page_summary' AND status = 'queued' AND params = ?",
+        (json.dumps({"page_id": page_id}),)
+    ).fetchone()
+    if pending is None:
+        # 연달아 저장할 때 요약을 매번 만들지 않도록 조금 늦게 실행합니다. (그 사이 저장은 같은 작업으로 합쳐짐)
+        enqueue_job("page_summary", {"page_id": page_id}, run_after=PAGE_SUMMARY_DELAY_SECONDS)
+
+def get_page_summaries(page_ids):
+    """현재 본문 기준으로 유효한 요약을 {page_id: summary}로 반환합니다. (없거나 오래된 요약은 제외)"""
+    page_ids = list(page_ids)
+    if not page_ids:
+        return {}
+    rows = get_db_connection().execute(
+        "SELECT s.page_id, s.summary FROM page_summaries s "
+        "JOIN page_bodies b ON b.page_id = s.page_id AND b.sha256 = s.content_sha256 "
+        "WHERE s.page_id IN ({})".format(",".join("?" * len(page_ids))),
+        page_ids
+    ).fetchall()
+    return {r['page_id']: r['summary'] for r in rows}
+
+def save_page_summary(page_id, content_sha256, summary):
+    """content_sha256 본문으로 만든 요약을 저장합니다. (페이지가 이미 삭제되었으면 무시)"""
+    with transaction(affects_workspace=False) as conn:
+        conn.execute(
+            '''
+            INSERT OR REPLACE INTO page_summaries (page_id, content_sha256, summary, created_at)
+            SELECT id, ?, ?, ? FROM pages WHERE id = ?
+            ''',
+            (content_sha256, summary, time.time(), page_id)
+        )
+
+# — 페이지 수정 이력 — #
+# 리비전은 수정할 때만 남깁니다. 처음 수정할 때 수정 전 본문을 1번 리비전(스냅샷, 작성 시각 미상)으로 저장하고,
+# 이후에는 REVISION_SNAPSHOT_INTERVAL마다 스냅샷, 그 사이는 줄 단위 차이(delta)를 저장합니다.
+# 어떤 리비전이든 직전 스냅샷에서 최대 REVISION_SNAPSHOT_INTERVAL - 1개의 delta만 적용하면 복원됩니다.
+
+def _make_delta(old, new):
+    """old → new 줄 단위 차이. 양수는 old에서 n줄 복사, 음수는 n줄 건너뛰기, 리스트는 새 줄 삽입입니다."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(b[j1:j2])
+    return ops
+
+def _apply_delta(old, ops):
+    a = old.splitlines(keepends=True)
+    out = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, list):
+            out.extend(op)
+        elif op > 0:
+            out.extend(a[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+def _record_page_revision(conn, page_id, previous, content):
+    last = conn.execute('''
+    SELECT revision,
+           (SELECT MAX(revision) FROM page_revisions WHERE page_id = ? AND kind = 'snapshot') AS snapshot_revision
+    FROM page_revisions WHERE page_id = ? ORDER BY revision DESC LIMIT 1
+    ''', (page_id, page_id)).fetchone()
+    if last is None:
+        conn.execute(
+            "INSERT INTO page_revisions (page_id, revision, kind, size, created_at, body) VALUES (?, 1, 'snapshot', ?, NULL, ?)",
+            (page_id, len(previous), zlib.compress(previous.encode("utf-8"), PAGE_BODY_COMPRESS_LEVEL))
+        )
+        last = {'revision': 1, 'snapshot_revision': 1}
+
+    revision = last['revision'] + 1
+    snapshot = zlib.compress(content.encode("utf-8"), PAGE_BODY_COMPRESS_LEVEL)
+    kind, body = "snapshot", snapshot
+    if revision - last['snapshot_revision'] < REVISION_SNAPSHOT_INTERVAL:
+        delta = zlib.compress(
+            json.dumps(_make_delta(previous, content), ensure_ascii=False).encode("utf-8"),
+            PAGE_BODY_COMPRESS_LEVEL
+        )
+        # 거의 전부 바뀐 경우에는 delta보다 스냅샷이 작거나 비슷하므로 스냅샷으로 저장합니다.
+        if len(delta) < len(snapshot) * 0.8:
+            kind, body = "delta", delta
+    conn.execute(
+        "INSERT INTO page_revisions (page_id, revision, kind, size, created_at, body) VALUES (?, ?, ?, ?, ?, ?)",
+        (page_id, revision, kind, len(content), time.time(), body)
+    )
+
+    # 보관 개수를 넘으면, 남길 구간이 스냅샷에서 시작하도록 그 이전 리비전을 모두 삭제합니다.
+    if revision > REVISION_KEEP_MAX:
+        keep_from = conn.execute('''
+        SELECT MIN(revision) FROM page_revisions
+        WHERE page_id = ? AND kind = 'snapshot' AND revision > ?
+        ''', (page_id, revision - REVISION_KEEP_MAX)).fetchone()[0]
+        if keep_from is not None:
+            conn.execute(
+                "DELETE FROM page_revisions WHERE page_id = ? AND revision < ?", (page_id, keep_from)
+            )
+    return revision
+
+def get_page_revisions(page_id):
+    """페이지의 리비전 목록 [{revision, kind, size, created_at}]을 오래된 순으로 반환합니다."""
+    rows = get_db_connection().execute(
+        "SELECT revision, kind, size, created_at FROM page_revisions WHERE page_id = ? ORDER BY revision",
+        (page_id,)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+def get_page_revision(page_id, revision):
+    """특정 리비전의 본문을 복원합니다. (없는 리비전은 None)"""
+    rows = get_db_connection().execute('''
+    SELECT revision, kind, body FROM page_revisions
+    WHERE page_id = ? AND revision <= ? AND revision >= (
+        SELECT MAX(revision) FROM page_revisions
+        WHERE page_id = ? AND revision <= ? AND kind = 'snapshot'
+    )
+    ORDER BY revision
+    ''', (page_id, revision, page_id, revision)).fetchall()
+    if not rows or rows[-1]['revision'] != revision:
+        return None
+    text = ""
+    for r in rows:
+        data = zlib.decompress(r['body']).decode("utf-8")
+        text = data if r['kind'] == "snapshot" else _apply_delta(text, json.loads(data))
+    return text
+
+def diff_page_revisions(page_id, from_revision, to_revision=None, context_lines=2):
+    """두 리비전 사이의 unified diff를 반환합니다. to_revision을 생략하면 최신 리비전과 비교합니다."""
+    if to_revision is None:
+        to_revision = get_db_connection().execute(
+            "SELECT MAX(revision) FROM page_revisions WHERE page_id = ?", (page_id,)
+        ).fetchone()[0]
+    old = get_page_revision(page_id, from_revision)
+    new = get_page_revision(page_id, to_revision) if to_revision is not None else None
+    if old is None or new is None:
+        return ""
+    return "\n".join(difflib.unified_diff(
+        old.splitlines(), new.splitlines(),
+        fromfile=f"rev{from_revision}", tofile=f"rev{to_revision}", n=context_lines, lineterm="",
+    ))
+
+def get_latest_page_changes(page_ids):
+    """페이지별 마지막 수정의 diff를 {page_id: {from_revision, to_revision, changed_at, diff}}로 반환합니다.
+
+    수정 이력이 없는(한 번도 수정되지 않은) 페이지는 제외됩니다.
+    """
+    page_ids = list(page_ids)
+    if not page_ids:
+        return {}
+    rows = get_db_connection().execute(
+        "SELECT page_id, MAX(revision) AS revision, MAX(created_at) AS changed_at FROM page_revisions "
+        "WHERE page_id IN ({}) GROUP BY page_id".format(",".join("?" * len(page_ids))),
+        page_ids
+    ).fetchall()
+    changes = {}
+    for r in rows:
+        if r['revision'] < 2:
+            continue
+        changes[r['page_id']] = {
+            'from_revision': r['revision'] - 1,
+            'to_revision': r['revision'],
+            'changed_at': r['changed_at'],
+            'diff': diff_page_revisions(r['page_id'], r['revision'] - 1, r['revision']),
+        }
+    return changes
+
+# — 워크스페이스 스냅샷 (읽기 모델) — #
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_workspace_snapshot():
+    """폴더 목록과 페이지 메타데이터(id, 이름, 폴더, 날짜, 크기)를 반환합니다.
+
+    한 번의 쿼리로 읽어 모든 세션이 공유하며, 마지막으로 읽은 뒤 쓰기가 없었다면
+    DB에 접근하지 않고 메모리의 스냅샷을 그대로 돌려줍니다. 반환값은 공유 객체이므로 수정하지 않습니다.
+
+    Returns:
+        {"generation", "folders": [{id, folder_name}],
+         "pages_by_folder": {folder_id: [page]}, "pages": {page_id: page}}
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and snapshot['generation'] == _write_generation and snapshot['path'] == DB_PATH:
+        return snapshot
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is not None and snapshot['generation'] == _write_generation and snapshot['path'] == DB_PATH:
+            return snapshot
+        # 쿼리 전에 세대를 읽어 두어야 읽는 도중의 쓰기가 다음 호출에서 반영됩니다.
+        generation = _write_generation
+        rows = get_db_connection().execute('''
+        SELECT f.id AS folder_id, f.folder_name,
+               p.id AS page_id, p.page_name, p.date, b.size
+        FROM folders f
+        LEFT JOIN pages p ON p.folder_id = f.id
+        LEFT JOIN page_bodies b ON b.page_id = p.id
+        ORDER BY f.id, p.id
+        ''').fetchall()
+        folders = []
+        pages_by_folder = {}
+        pages = {}
+        for r in rows:
+            fid = r['folder_id']
+            if fid not in pages_by_folder:
+                folders.append({'id': fid, 'folder_name': r['folder_name']})
+                pages_by_folder[fid] = []
+            if r['page_id'] is None:
+                continue
+            page = {
+                'id': r['page_id'],
+                'page_name': r['page_name'],
+                'folder_id': fid,
+                'date': r['date'],
+                'size': r['size'] or 0,
+            }
+            pages_by_folder[fid].append(page)
+            pages[page['id']] = page
+        _snapshot = {
+            'generation': generation,
+            'path': DB_PATH,
+            'folders': folders,
+            'pages_by_folder': pages_by_folder,
+            'pages': pages,
+        }
+        return _snapshot
+
 # — 채팅 CRUD — #
 
 def get_all_chats():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT chat_name FROM chats ORDER BY id")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = conn.execute("SELECT chat_name FROM chats ORDER BY id").fetchall()
     return [r['chat_name'] for r in rows]
 
 def add_chat(chat_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO chats (chat_name) VALUES (?)", (chat_name,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO chats (chat_name) VALUES (?)", (chat_name,))
     return True
 
 def delete_chat(chat_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM messages WHERE chat_name = ?", (chat_name,))
-    cursor.execute("DELETE FROM chats WHERE chat_name = ?", (chat_name,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM chat_summaries WHERE chat_name = ?", (chat_name,))
+        conn.execute(
+            "DELETE FROM messages WHERE chat_id = (SELECT id FROM chats WHERE chat_name = ?)",
+            (chat_name,)
+        )
+        conn.execute("DELETE FROM chats WHERE chat_name = ?", (chat_name,))
     return True
 
-def get_chat_messages(chat_name):
+def get_chat_messages(chat_name, after_id=0):
+    """대화의 메시지를 오래된 순으로 반환합니다. (after_id보다 뒤의 메시지만)"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT role, content FROM messages WHERE chat_name = ? ORDER BY id",
+    rows = conn.execute(
+        '''
+        SELECT id, role, content FROM messages
+        WHERE chat_id = (SELECT id FROM chats WHERE chat_name = ?) AND id > ?
+        ORDER BY id
+        ''',
+        (chat_name, after_id)
+    ).fetchall()
+    return [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in rows]
+
+def get_chat_messages_page(chat_name, before_id=None, limit=CHAT_PAGE_SIZE):
+    """before_id보다 오래된 메시지 중 최신 limit개를 오래된 순으로 반환합니다. (keyset 페이지네이션)
+
+    Returns:
+        (메시지 리스트, 더 오래된 메시지가 남아 있는지 여부)
+    """
+    conn = get_db_connection()
+    rows = conn.execute(
+        '''
+        SELECT id, role, content FROM messages
+        WHERE chat_id = (SELECT id FROM chats WHERE chat_name = ?) AND id < ?
+        ORDER BY id DESC LIMIT ?
+        ''',
+        (chat_name, before_id if before_id is not None else 2 ** 63 - 1, limit + 1)
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in rows], has_more
+
+def add_message(chat_name, role, content):
+    """메시지를 저장하고 새 메시지 id를 반환합니다. (답변의 페이지 링크도 함께 저장)"""
+    return add_message_async(chat_name, role, content).result()
+
+def add_message_async(chat_name, role, content):
+    """메시지 저장을 그룹 커밋으로 제출하고 새 메시지 id의 Future를 반환합니다."""
+    return submit_write(_insert_message, chat_name, role, content)
+
+def _insert_message(chat_name, role, content):
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO messages (chat_id, role, content) "
+            "VALUES ((SELECT id FROM chats WHERE chat_name = ?), ?, ?)",
+            (chat_name, role, content)
+        )
+        message_id = cursor.lastrowid
+        if role == "assistant":
+            _store_message_refs(conn, message_id, content)
+    return message_id
+
+_PAGE_REF_RE = re.compile(r'\[([^\]]+)\]\(page://(\d+)\)')
+
+def extract_page_refs(content):
+    """본문의 [제목](page://id) 링크를 (제목, page_id) 리스트로 반환합니다. (같은 페이지는 처음 것만)"""
+    refs = {}
+    for title, pid in _PAGE_REF_RE.findall(content or ""):
+        refs.setdefault(int(pid), title)
+    return [(title, pid) for pid, title in refs.items()]
+
+def _store_message_refs(cursor, message_id, content):
+    cursor.executemany(
+        "INSERT OR IGNORE INTO message_refs (message_id, page_id, title, position) VALUES (?, ?, ?, ?)",
+        [(message_id, pid, title, i) for i, (title, pid) in enumerate(extract_page_refs(content))]
+    )
+
+def get_message_refs(message_ids):
+    """메시지별 페이지 링크를 {message_id: [(제목, page_id), ...]}로 반환합니다."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return {}
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT message_id, page_id, title FROM message_refs WHERE message_id IN ({}) "
+        "ORDER BY message_id, position".format(",".join("?" * len(message_ids))),
+        message_ids
+    ).fetchall()
+    refs = {}
+    for r in rows:
+        refs.setdefault(r['message_id'], []).append((r['title'], r['page_id']))
+    return refs
+
+def get_chat_summary(chat_name):
+    """대화의 누적 요약과 요약에 포함된 마지막 메시지 id를 반환합니다. 없으면 None."""
+    row = get_db_connection().execute(
+        "SELECT summary, summarized_until FROM chat_summaries WHERE chat_name = ?",
         (chat_name,)
+    ).fetchone()
+    return dict(row) if row else None
+
+def save_chat_summary(chat_name, summary, summarized_until):
+    """대화의 누적 요약을 저장합니다. (summarized_until: 요약에 포함된 마지막 메시지 id)"""
+    with transaction(affects_workspace=False) as conn:
+        conn.execute(
+            '''
+            INSERT INTO chat_summaries (chat_name, summary, summarized_until) VALUES (?, ?, ?)
+            ON CONFLICT (chat_name) DO UPDATE SET
+                summary = excluded.summary, summarized_until = excluded.summarized_until
+            ''',
+            (chat_name, summary, summarized_until)
+        )
+    return True
+
+# — 날짜·폴더 범위 조회 — #
+
+def _scope_conditions(start=None, end=None, folder_ids=None, alias=""):
+    """기간·폴더 범위를 pages 테이블(별칭 alias)에 대한 SQL 조건 목록과 매개변수로 바꿉니다."""
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{alias}date_norm >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{alias}date_norm <= ?")
+        params.append(end)
+    if folder_ids is not None:
+        conditions.append("{}folder_id IN ({})".format(alias, ",".join("?" * len(folder_ids))) if folder_ids else "0")
+        params.extend(folder_ids)
+    return conditions, params
+
+def get_pages_by_date(start=None, end=None, folder_ids=None, limit=None):
+    """기록 날짜가 start~end(양 끝 포함, 'YYYY-MM-DD')인 페이지 메타데이터를 최신순으로 반환합니다.
+
+    folder_ids를 주면 그 폴더들로 한정합니다. 날짜 범위를 주면 날짜를 해석할 수 없는 페이지는 제외됩니다.
+    정규화된 date_norm 인덱스를 타므로 전체 페이지를 훑지 않습니다.
+    """
+    conditions, params = _scope_conditions(start, end, folder_ids)
+    sql = "SELECT id, page_name, folder_id, date, date_norm FROM pages"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY date_norm DESC, id DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(r) for r in get_db_connection().execute(sql, params).fetchall()]
+
+_QUOTE_PAIRS = ('""', "''", '“”', '‘’', '「」', '『』')
+
+def find_folder_ids(text, explicit=False):
+    """이름이 text 안에 들어 있는 폴더의 id 목록을 반환합니다. (대소문자·공백 무시, 두 글자 이상)
+
+    explicit=True이면 "회의록 폴더"처럼 뒤에 '폴더'가 붙었거나 따옴표로 감싼 이름만 찾습니다.
+    ("회의록 있어?"의 '회의록'은 폴더가 아니라 문서 종류를 가리킬 수 있으므로)
+    """
+    haystack = re.sub(r'\s+', '', text or "").lower()
+    ids = []
+    for folder in get_workspace_snapshot()['folders']:
+        name = re.sub(r'\s+', '', folder['folder_name']).lower()
+        if len(name) < 2:
+            continue
+        if explicit:
+            found = name + "폴더" in haystack or any(o + name + c in haystack for o, c in _QUOTE_PAIRS)
+        else:
+            found = name in haystack
+        if found:
+            ids.append(folder['id'])
+    return ids
+
+def get_question_scope(question, today=None):
+    """질문의 기간 표현과 명시한 폴더("X 폴더", 따옴표로 감싼 이름)로 검색 범위를 정합니다.
+
+    Returns:
+        {"start", "end", "folder_ids"} 딕셔너리 (해당 없는 항목은 None), 범위 표현이 없으면 None
+    """
+    date_range = dates.parse_date_range(question, today)
+    folder_ids = find_folder_ids(question, explicit=True) or None
+    if date_range is None and folder_ids is None:
+        return None
+    start, end = date_range or (None, None)
+    return {"start": start, "end": end, "folder_ids": folder_ids}
+
+# — 페이지 검색 (BM25) — #
+
+_WORD_RE = re.compile(r'\w+')
+_HANGUL_RE = re.compile(r'[가-힣]')
+
+def split_into_chunks(text, max_chars=CHUNK_MAX_CHARS):
+    """본문을 문단 단위로 묶어 max_chars 이하의 조각 리스트로 나눕니다."""
+    chunks = []
+    current = ""
+    for para in re.split(r'\n\s*\n', text or ""):
+        para = para.strip()
+        if not para:
+            continue
+        # 한 문단이 너무 길면 max_chars 단위로 자릅니다.
+        for i in range(0, len(para), max_chars):
+            piece = para[i:i + max_chars]
+            if current and len(current) + len(piece) + 2 > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _index_page_chunks(cursor, page_id, page_name, content):
+    """페이지의 검색 조각을 새 내용으로 교체합니다. (벡터는 커밋 후 색인 스레드에서 갱신)"""
+    cursor.execute("DELETE FROM page_chunks WHERE page_id = ?", (page_id,))
+    cursor.executemany(
+        "INSERT INTO page_chunks (page_id, chunk_index, title, body) VALUES (?, ?, ?, ?)",
+        [(page_id, i, page_name, chunk) for i, chunk in enumerate(split_into_chunks(content))]
     )
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"]} for r in rows]
 
-def add_message(chat_name, role, content):
+def _build_fts_query(text):
+    """사용자 질문을 FTS5 MATCH 식으로 변환합니다.
+
+    한국어 단어는 조사가 붙어 있으므로 끝 1~2음절을 뗀 접두어도 함께 검색합니다.
+    """
+    terms = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if _HANGUL_RE.search(word) and len(word) >= 3:
+            variants = [word[:n] for n in range(max(2, len(word) - 2), len(word) + 1)]
+        else:
+            variants = [word]
+        for v in variants:
+            terms.append('"{}"*'.format(v.replace('"', '""')))
+    return " OR ".join(dict.fromkeys(terms))
+
+def search_page_chunks(query, limit=RETRIEVAL_TOP_K, scope=None):
+    """질문과 관련된 페이지 조각을 BM25 점수 순으로 반환합니다.
+
+    scope({"start", "end", "folder_ids"})를 주면 pages와 조인하여 범위 밖 조각은 점수를 매기지 않습니다.
+    """
+    match = _build_fts_query(query)
+    if not match:
+        return []
+    join, conditions, params = "", ["page_chunks_fts MATCH ?"], [match]
+    if scope is not None:
+        join = "JOIN pages p ON p.id = c.page_id"
+        scope_conditions, scope_params = _scope_conditions(**scope, alias="p.")
+        conditions += scope_conditions
+        params += scope_params
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO messages (chat_name, role, content) VALUES (?, ?, ?)",
-        (chat_name, role, content)
+    rows = conn.execute(f'''
+    SELECT c.id, c.page_id, c.title AS page_name, c.body,
+           bm25(page_chunks_fts, 2.0, 1.0) AS score
+    FROM page_chunks_fts
+    JOIN page_chunks c ON c.id = page_chunks_fts.rowid
+    {join}
+    WHERE {" AND ".join(conditions)}
+    ORDER BY score
+    LIMIT ?
+    ''', (*params, limit)).fetchall()
+    return [dict(r) for r in rows]
+
+def _scoped_page_ids(scope):
+    conditions, params = _scope_conditions(**scope)
+    sql = "SELECT id FROM pages"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return [r['id'] for r in get_db_connection().execute(sql, params)]
+
+def _recency_boost(date_norm, today):
+    if not date_norm:
+        return 1.0
+    age_days = max((today - date.fromisoformat(date_norm)).days, 0)
+    return 1.0 + RECENCY_WEIGHT * 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+def rank_context_chunks(query, top_k=RETRIEVAL_TOP_K, scope=None, today=None, boost_folder_ids=()):
+    """키워드·의미 검색 결과를 RRF로 합치고 최신 페이지에 가중치를 주어 상위 top_k 조각을 순위대로 반환합니다.
+
+    각 조각에는 페이지 기록 날짜('YYYY-MM-DD' 또는 None)가 'date'로, 키워드 검색에서도 찾았는지가
+    'keyword_match'로 붙습니다.
+    scope({"start", "end", "folder_ids"})를 주면 범위 안의 페이지에서만 찾습니다. 키워드 검색은 SQL 조인으로,
+    의미 검색은 범위 안 페이지의 벡터 행만 골라 점수를 계산합니다.
+    boost_folder_ids 폴더의 페이지는 제외하지 않고 점수만 (1 + FOLDER_MATCH_BOOST)배로 올립니다.
+    """
+    page_ids = None
+    if scope is not None:
+        page_ids = _scoped_page_ids(scope)
+        if not page_ids:
+            return []
+    candidates = {}
+    for keyword, results in ((True, search_page_chunks(query, top_k * 2, scope)),
+                             (False, search_similar_chunks(query, top_k * 2, page_ids))):
+        for rank, chunk in enumerate(results):
+            entry = candidates.setdefault(chunk['id'], dict(chunk, score=0.0, keyword_match=False))
+            entry['score'] += 1.0 / (RRF_K + rank + 1)
+            entry['keyword_match'] |= keyword
+    if not candidates:
+        return []
+    pids = list({c['page_id'] for c in candidates.values()})
+    pages = {
+        r['id']: r for r in get_db_connection().execute(
+            "SELECT id, folder_id, date_norm FROM pages WHERE id IN ({})".format(",".join("?" * len(pids))), pids
+        )
+    }
+    today = today or date.today()
+    for chunk in candidates.values():
+        page = pages.get(chunk['page_id'])
+        chunk['date'] = page['date_norm'] if page else None
+        chunk['score'] *= _recency_boost(chunk['date'], today)
+        if page and page['folder_id'] in boost_folder_ids:
+            chunk['score'] *= 1.0 + FOLDER_MATCH_BOOST
+    return sorted(candidates.values(), key=lambda c: c['score'], reverse=True)[:top_k]
+
+def rank_question_chunks(question, top_k=RETRIEVAL_TOP_K, today=None):
+    """질문에 기간("지난달", "2025년 3월")이나 명시한 폴더("X 폴더")가 있으면 해당 페이지 안에서만 순위를 매깁니다.
+
+    범위 안에서 키워드로 찾은 조각이 하나도 없으면 전체 페이지에서 찾습니다. (의미 검색은 관련 없는 조각도
+    대개 양의 유사도를 내므로 범위 결과가 비었는지만으로는 판단하지 않습니다)
+    이름만 나온 폴더는 범위로 자르지 않고 그 폴더 페이지의 순위만 올립니다.
+    """
+    boost_folder_ids = set(find_folder_ids(question))
+    scope = get_question_scope(question, today)
+    if scope is not None:
+        chunks = rank_context_chunks(question, top_k, scope, today, boost_folder_ids)
+        if any(c['keyword_match'] for c in chunks):
+            return chunks
+    return rank_context_chunks(question, top_k, today=today, boost_folder_ids=boost_folder_ids)
+
+# — 페이지 검색 (벡터) — #
+
+_vector_index = None
+_vector_index_path = None
+_vector_index_lock = threading.Lock()
+
+def get_vector_index():
+    """DB 파일 옆에 저장된 조각 벡터 인덱스를 반환합니다.
+
+    처음 열 때 색인의 조각 id 지문(개수, 최대 id, 합계)이 page_chunks와 다르면 (임베더 변경, 기존 DB,
+    반영되지 못한 갱신 등) 전체를 다시 색인합니다. 열고 나면 색인 스레드가 남은 갱신을 이어서 처리합니다.
+    vector_index(numpy)는 검색·저장에서 처음 쓸 때 불러오므로 페이지만 둘러볼 때는 로드하지 않습니다.
+    """
+    global _vector_index, _vector_index_path
+    with _vector_index_lock:
+        if _vector_index is None or _vector_index_path != DB_PATH:
+            import vector_index
+            conn = get_db_connection()
+            index = vector_index.VectorIndex(os.path.splitext(DB_PATH)[0] + ".vectors")
+            stored = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0), TOTAL(id) FROM page_chunks").fetchone()
+            if tuple(stored) != index.fingerprint():
+                index.reset()
+                cursor = conn.execute("SELECT id, page_id, body FROM page_chunks ORDER BY id")
+                while True:
+                    rows = cursor.fetchmany(256)
+                    if not rows:
+                        break
+                    index.add(
+                        [r['id'] for r in rows],
+                        [r['page_id'] for r in rows],
+                        [r['body'] for r in rows]
+                    )
+            _vector_index = index
+            _vector_index_path = DB_PATH
+            _ensure_vector_worker()
+    return _vector_index
+
+# 임베딩은 조각당 수 ms가 걸리고 첫 사용 시 전체 재색인이 일어날 수 있으므로, 쓰기 스레드가 아닌
+# 색인 전용 스레드에서 처리합니다. 조각을 바꾼 트랜잭션은 vector_pending에 페이지 id만 남기고 바로 끝나며,
+# 색인 스레드는 반영에 성공한 행만 지우므로 실패하거나 프로세스가 끝나도 갱신이 사라지지 않습니다.
+
+# 실패한 갱신을 다시 시도하는 간격과 한 번에 처리하는 요청 수
+VECTOR_RETRY_SECONDS = 30.0
+VECTOR_BATCH = 500
+
+_vector_wakeup = threading.Event()
+_vector_thread = None
+_vector_thread_lock = threading.Lock()
+
+def _queue_vector_update(conn, page_ids):
+    """조각이 바뀐 페이지를 현재 트랜잭션에서 vector_pending에 기록하고, 커밋 후 색인 스레드를 깨웁니다."""
+    conn.executemany("INSERT INTO vector_pending (page_id) VALUES (?)", [(pid,) for pid in page_ids])
+    _after_commit(_wake_vector_worker)
+
+def _wake_vector_worker():
+    _ensure_vector_worker()
+    _vector_wakeup.set()
+
+def _ensure_vector_worker():
+    global _vector_thread
+    with _vector_thread_lock:
+        if _vector_thread is None or not _vector_thread.is_alive():
+            _vector_thread = threading.Thread(target=_vector_loop, name="vector-index", daemon=True)
+            _vector_thread.start()
+
+def _vector_loop():
+    while True:
+        try:
+            progressed = _process_vector_pending()
+        except Exception as e:
+            print(f"벡터 색인 갱신 중 오류 발생 ({VECTOR_RETRY_SECONDS:.0f}초 후 재시도): {str(e)}")
+            progressed = False
+        if not progressed:
+            _vector_wakeup.wait(VECTOR_RETRY_SECONDS)
+            _vector_wakeup.clear()
+
+def _process_vector_pending():
+    """밀려 있는 갱신 요청을 페이지 id로 합쳐 반영하고, 처리한 요청이 있으면 True를 반환합니다.
+
+    반영한 요청만 지웁니다. 처리 도중 커밋된 요청은 id가 더 크므로 남아서 다음 차례에 반영됩니다.
+    """
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT id, page_id FROM vector_pending ORDER BY id LIMIT ?", (VECTOR_BATCH,)
+    ).fetchall()
+    if not rows:
+        return False
+    _update_page_vectors({r['page_id'] for r in rows})
+    with transaction(affects_workspace=False) as conn:
+        conn.execute("DELETE FROM vector_pending WHERE id <= ?", (rows[-1]['id'],))
+    return True
+
+def wait_for_vector_updates(poll_seconds=0.01):
+    """예약된 벡터 갱신이 모두 반영될 때까지 기다립니다. (벤치마크 등 쓰기 직후 검색할 때)"""
+    _wake_vector_worker()
+    conn = get_db_connection()
+    while conn.execute("SELECT 1 FROM vector_pending LIMIT 1").fetchone():
+        time.sleep(poll_seconds)
+
+def _update_page_vectors(page_ids, batch=500):
+    """페이지의 기존 벡터를 지우고 현재 조각을 DB에서 다시 읽어 임베딩합니다.
+
+    갱신 요청이 커밋 순서와 다르게 처리되어도 항상 마지막으로 커밋된 조각으로 색인됩니다.
+    """
+    index = get_vector_index()
+    conn = get_db_connection()
+    page_ids = list(page_ids)
+    for i in range(0, len(page_ids), batch):
+        part = page_ids[i:i + batch]
+        rows = conn.execute(
+            "SELECT id, page_id, body FROM page_chunks WHERE page_id IN ({}) ORDER BY id".format(
+                ",".join("?" * len(part))
+            ),
+            part
+        ).fetchall()
+        index.replace_pages(part, [r['id'] for r in rows], [r['page_id'] for r in rows], [r['body'] for r in rows])
+
+def search_similar_chunks(query, limit=RETRIEVAL_TOP_K, page_ids=None):
+    """질문과 의미가 가까운 페이지 조각을 코사인 유사도 순으로 반환합니다.
+
+    page_ids를 주면 그 페이지들의 벡터만 점수를 계산합니다. (SQL 매개변수로 넘기지 않으므로 개수 제한 없음)
+    """
+    if page_ids is not None and not page_ids:
+        return []
+    hits = get_vector_index().search(query, limit, page_ids)
+    if not hits:
+        return []
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT id, page_id, title AS page_name, body FROM page_chunks WHERE id IN ({})".format(
+            ",".join("?" * len(hits))
+        ),
+        [chunk_id for chunk_id, _, _ in hits]
+    ).fetchall()
+    rows = {r['id']: dict(r) for r in rows}
+    return [dict(rows[cid], score=score) for cid, _, score in hits if cid in rows]
+
+# — LLM 응답 캐시 — #
+
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 2000
+
+def get_page_content_hashes(page_ids):
+    """페이지별 본문 SHA-256 해시를 {page_id: hash}로 반환합니다. 없는 페이지는 제외됩니다."""
+    if not page_ids:
+        return {}
+    # 저장할 때 계산해 둔 해시를 쓰므로 본문을 읽거나 압축을 풀지 않습니다.
+    rows = get_db_connection().execute(
+        "SELECT page_id, sha256 FROM page_bodies WHERE page_id IN ({})".format(",".join("?" * len(page_ids))),
+        list(page_ids)
+    ).fetchall()
+    return {r['page_id']: r['sha256'] for r in rows}
+
+def get_cached_response(cache_key):
+    """만료되지 않은 캐시 응답을 반환하고 최근 사용 시각을 갱신합니다. 없으면 None."""
+    now = time.time()
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT response FROM llm_cache WHERE cache_key = ? AND created_at >= ?",
+        (cache_key, now - LLM_CACHE_TTL_SECONDS)
+    ).fetchone()
+    if not row:
+        return None
+    with transaction(affects_workspace=False) as conn:
+        conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+    return row['response']
+
+def put_cached_response(cache_key, response, page_ids=()):
+    """응답을 캐시에 저장하고, 만료·초과 항목을 오래 안 쓴 순서로 정리합니다."""
+    now = time.time()
+    with transaction(affects_workspace=False) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (cache_key, response, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+            (cache_key, response, now, now)
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO llm_cache_pages (cache_key, page_id) VALUES (?, ?)",
+            [(cache_key, pid) for pid in page_ids]
+        )
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL_SECONDS,))
+        conn.execute('''
+        DELETE FROM llm_cache WHERE cache_key IN (
+            SELECT cache_key FROM llm_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        ''', (LLM_CACHE_MAX_ENTRIES,))
+    return True
+
+def _invalidate_cached_responses(conn, page_ids):
+    """페이지가 바뀌거나 삭제되면 그 페이지를 참조한 캐시 응답을 지웁니다."""
+    if not page_ids:
+        return
+    conn.execute(
+        "DELETE FROM llm_cache WHERE cache_key IN "
+        "(SELECT cache_key FROM llm_cache_pages WHERE page_id IN ({}))".format(",".join("?" * len(page_ids))),
+        list(page_ids)
     )
-    conn.commit()
-    conn.close()
+
+# — PDF 변환 캐시 — #
+
+def get_pdf_conversion(pdf_sha256, docs_type, model, prompt_version):
+    """저장된 PDF 변환 결과를 반환합니다. 없으면 None."""
+    row = get_db_connection().execute(
+        '''
+        SELECT content FROM pdf_conversions
+        WHERE pdf_sha256 = ? AND docs_type = ? AND model = ? AND prompt_version = ?
+        ''',
+        (pdf_sha256, docs_type, model, prompt_version)
+    ).fetchone()
+    return row['content'] if row else None
+
+def save_pdf_conversion(pdf_sha256, docs_type, model, prompt_version, content):
+    """PDF 변환 결과를 저장합니다."""
+    with transaction(affects_workspace=False) as conn:
+        conn.execute(
+            '''
+            INSERT OR REPLACE INTO pdf_conversions
+                (pdf_sha256, docs_type, model, prompt_version, content, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (pdf_sha256, docs_type, model, prompt_version, content, time.time())
+        )
     return True
+
+# — 백그라운드 작업 큐 — #
+
+# 이 시간 동안 갱신이 없는 running 작업은 중단된 것으로 보고 다시 대기열에 넣습니다.
+JOB_STALE_SECONDS = 15 * 60
+# 완료·실패한 작업을 사이드바에 계속 보여줄 시간
+JOB_RECENT_SECONDS = 10 * 60
+
+def enqueue_job(kind, params, payload=None, folder_id=None, max_attempts=3, run_after=0.0):
+    """작업을 대기열에 추가하고 작업 id를 반환합니다. (run_after초 뒤부터 실행)"""
+    now = time.time()
+    with transaction(affects_workspace=False) as conn:
+        cursor = conn.execute(
+            '''
+            INSERT INTO jobs (kind, folder_id, params, payload, max_attempts, next_run_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (kind, folder_id, json.dumps(params, ensure_ascii=False), payload, max_attempts,
+             now + run_after, now, now)
+        )
+    return cursor.lastrowid
+
+def claim_next_job():
+    """실행할 차례인 작업 하나를 running으로 바꾸고 (payload 포함) 반환합니다. 없으면 None.
+
+    BEGIN IMMEDIATE 트랜잭션 안에서 고르고 표시하므로 여러 워커가 같은 작업을 가져가지 않습니다.
+    """
+    now = time.time()
+    with transaction(affects_workspace=False) as conn:
+        row = conn.execute(
+            '''
+            SELECT * FROM jobs WHERE status = 'queued' AND next_run_at <= ?
+            ORDER BY next_run_at, id LIMIT 1
+            ''',
+            (now,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (now, row['id'])
+        )
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['attempts'] += 1
+    return job
+
+def complete_job(job_id, result_page_id=None):
+    """작업을 완료로 표시하고 더 필요 없는 payload를 비웁니다.
+
+    결과 페이지 생성과 같은 transaction() 안에서 호출하면 재시도 시 중복 생성을 막을 수 있습니다.
+    """
+    with transaction(affects_workspace=False) as conn:
+        conn.execute(
+            '''
+            UPDATE jobs SET status = 'done', payload = NULL, error = NULL,
+                result_page_id = ?, updated_at = ?
+            WHERE id = ?
+            ''',
+            (result_page_id, time.time(), job_id)
+        )
+    return True
+
+def fail_job(job_id, error, retry_delay=None):
+    """작업 실패를 기록합니다. retry_delay가 있고 시도 횟수가 남았으면 그 뒤에 다시 실행합니다."""
+    now = time.time()
+    with transaction(affects_workspace=False) as conn:
+        row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return False
+        if retry_delay is not None and row['attempts'] < row['max_attempts']:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, next_run_at = ?, updated_at = ? WHERE id = ?",
+                (error, now + retry_delay, now, job_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', payload = NULL, error = ?, updated_at = ? WHERE id = ?",
+                (error, now, job_id)
+            )
+    return True
+
+def touch_job(job_id):
+    """실행 중인 작업의 updated_at을 갱신해 오래 걸리는 작업이 중단된 것으로 보이지 않게 합니다."""
+    with transaction(affects_workspace=False) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+    return cursor.rowcount > 0
+
+def requeue_stale_jobs(stale_seconds=JOB_STALE_SECONDS):
+    """stale_seconds 동안 갱신이 없는(중단된) running 작업을 다시 대기열에 넣고, 그 수를 반환합니다."""
+    now = time.time()
+    with transaction(affects_workspace=False) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', next_run_at = ?, updated_at = ? "
+            "WHERE status = 'running' AND updated_at < ?",
+            (now, now, now - stale_seconds)
+        )
+    return cursor.rowcount
+
+def get_folder_jobs(folder_id, recent_seconds=JOB_RECENT_SECONDS):
+    """폴더의 대기·실행 중 작업과 최근 끝난 작업 상태를 반환합니다. (payload는 읽지 않음)"""
+    rows = get_db_connection().execute(
+        '''
+        SELECT id, kind, status, params, attempts, error, result_page_id, updated_at
+        FROM jobs
+        WHERE folder_id = ? AND (status IN ('queued', 'running') OR updated_at >= ?)
+        ORDER BY id DESC LIMIT 20
+        ''',
+        (folder_id, time.time() - recent_seconds)
+    ).fetchall()
+    jobs = [dict(r) for r in rows]
+    for job in jobs:
+        job['params'] = json.loads(job['params'])
+    return jobs
+
+def get_jobs_by_folder(recent_seconds=JOB_RECENT_SECONDS, per_folder=20):
+    """모든 폴더의 대기·실행 중 작업과 최근 끝난 작업 상태를 {folder_id: [job]}로 한 번에 반환합니다.
+
+    사이드바가 폴더마다 get_folder_jobs를 호출하지 않도록 한 쿼리로 읽습니다. (폴더당 최신 per_folder개)
+    """
+    rows = get_db_connection().execute(
+        '''
+        SELECT id, folder_id, kind, status, params, attempts, error, result_page_id, updated_at
+        FROM jobs
+        WHERE folder_id IS NOT NULL AND (status IN ('queued', 'running') OR updated_at >= ?)
+        ORDER BY folder_id, id DESC
+        ''',
+        (time.time() - recent_seconds,)
+    ).fetchall()
+    jobs_by_folder = {}
+    for r in rows:
+        jobs = jobs_by_folder.setdefault(r['folder_id'], [])
+        if len(jobs) < per_folder:
+            job = dict(r)
+            job['params'] = json.loads(job['params'])
+            jobs.append(job)
+    return jobs_by_folder
+
+# 모든 공개 DB 함수의 실행 시간과 반환 행 수를 기록합니다. (연결·트랜잭션 헬퍼는 제외)
+metrics.instrument_module(
+    globals(), skip={"get_db_connection", "transaction", "get_write_generation", "submit_write"}
+)
@@ -0,0 +1,177 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+import db
+
+# DB의 jobs 테이블을 처리하는 백그라운드 워커 (Streamlit 세션과 독립적으로 동작)
+#
+# openai SDK와 PDF 변환 모듈은 처리 함수가 처음 실행될 때 불러옵니다. 앱은 작업 등록(enqueue)만
+# 하므로, 이 모듈을 import해도 시작 시간이 늘지 않습니다.
+
+WORKER_THREADS = 4
+POLL_INTERVAL_SECONDS = 2.0
+RETRY_BASE_DELAY_SECONDS = 5.0
+# 실행 중인 작업의 updated_at을 갱신하는 주기 (db.JOB_STALE_SECONDS보다 충분히 짧게)
+HEARTBEAT_INTERVAL_SECONDS = db.JOB_STALE_SECONDS / 3
+# 대기열이 비었을 때 중단된 작업을 다시 넣는 검사 주기
+STALE_CHECK_INTERVAL_SECONDS = 60.0
+
+_handlers = {}
+_wakeup = threading.Event()
+_threads = []
+_start_lock = threading.Lock()
+_stale_check_lock = threading.Lock()
+_last_stale_check = 0.0
+
+
+def register_handler(kind):
+    """작업 종류별 처리 함수를 등록하는 데코레이터.
+
+    처리 함수는 job 딕셔너리를 받아 외부 작업(LLM 호출 등)을 한 뒤,
+    결과 저장과 db.complete_job을 같은 db.transaction() 안에서 호출해야 합니다.
+    """
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def _transient_errors():
+    """일시적인 오류만 재시도합니다. (그 외 오류는 바로 실패 처리)"""
+    import openai
+    return (
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+        sqlite3.OperationalError,
+    )
+
+
+@register_handler("pdf_ingest")
+def _handle_pdf_ingest(job):
+    import pdf_utils
+    params = job['params']
+    content = pdf_utils.convert_pdf_bytes(job['payload'], params['docs_type'], params['filename'])
+    with db.transaction():
+        page_id = db.add_page_with_content(params['page_name'], job['folder_id'], content, params['date'])
+        db.complete_job(job['id'], page_id)
+
+
+@register_handler("page_summary")
+def _handle_page_summary(job):
+    import page_summary
+    page_id = job['params']['page_id']
+    page = db.get_page(page_id)
+    # 그 사이 페이지가 삭제되었거나, 현재 본문의 요약이 이미 있으면 할 일이 없습니다.
+    if page is None or db.get_page_summaries([page_id]):
+        db.complete_job(job['id'])
+        return
+    # 해시는 요약할 본문에서 직접 계산합니다. 따로 읽으면 그 사이 저장된 새 본문의 해시로
+    # 옛 본문의 요약이 저장되어, 다음 요약 작업이 유효한 요약으로 보고 건너뜁니다.
+    content_hash = hashlib.sha256(page['content'].encode("utf-8")).hexdigest()
+    summary = page_summary.summarize_page(page['page_name'], page['content'])
+    with db.transaction(affects_workspace=False):
+        db.save_page_summary(page_id, content_hash, summary)
+        db.complete_job(job['id'])
+
+
+def enqueue_pdf_ingest(folder_id, page_name, date_str, docs_type, filename, data):
+    """PDF 변환 작업을 대기열에 넣고 워커를 깨웁니다."""
+    job_id = db.enqueue_job(
+        "pdf_ingest",
+        {"page_name": page_name, "date": date_str, "docs_type": docs_type, "filename": filename},
+        payload=data,
+        folder_id=folder_id,
+    )
+    _wakeup.set()
+    return job_id
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """블록이 실행되는 동안 주기적으로 작업의 updated_at을 갱신합니다.
+
+    PDF 변환처럼 JOB_STALE_SECONDS보다 오래 걸리는 작업이 다른 워커에 의해 다시 대기열에 들어가지 않게 합니다.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL_SECONDS):
+            try:
+                db.touch_job(job_id)
+            except sqlite3.OperationalError as e:
+                print(f"작업 {job_id} 상태 갱신 중 오류 발생: {str(e)}")
+
+    thread = threading.Thread(target=beat, name=f"job-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def _run_job(job):
+    handler = _handlers.get(job['kind'])
+    if handler is None:
+        db.fail_job(job['id'], f"알 수 없는 작업 종류: {job['kind']}")
+        return
+    try:
+        with _heartbeat(job['id']):
+            handler(job)
+    except _transient_errors() as e:
+        delay = RETRY_BASE_DELAY_SECONDS * 2 ** (job['attempts'] - 1)
+        print(f"작업 {job['id']} 일시적 오류, {delay:.0f}초 후 재시도: {str(e)}")
+        db.fail_job(job['id'], str(e), retry_delay=delay)
+    except Exception as e:
+        traceback.print_exc()
+        db.fail_job(job['id'], str(e))
+
+
+def _requeue_stale_jobs():
+    """STALE_CHECK_INTERVAL_SECONDS마다 한 번, 갱신이 멈춘 running 작업을 다시 대기열에 넣습니다. (워커 스레드 간 공유)"""
+    global _last_stale_check
+    with _stale_check_lock:
+        now = time.monotonic()
+        if now - _last_stale_check < STALE_CHECK_INTERVAL_SECONDS:
+            return
+        _last_stale_check = now
+    try:
+        if db.requeue_stale_jobs():
+            _wakeup.set()
+    except sqlite3.OperationalError as e:
+        print(f"중단된 작업 확인 중 오류 발생: {str(e)}")
+
+
+def _worker_loop():
+    while True:
+        try:
+            job = db.claim_next_job()
+        except sqlite3.OperationalError as e:
+            print(f"작업 조회 중 오류 발생: {str(e)}")
+            job = None
+        if job is None:
+            _requeue_stale_jobs()
+            _wakeup.wait(POLL_INTERVAL_SECONDS)
+            _wakeup.clear()
+            continue
+        _run_job(job)
+
+
+def start_worker(num_threads=WORKER_THREADS):
+    """워커 스레드를 프로세스당 한 번만 시작합니다. (여러 번 호출해도 안전)
+
+    시작할 때 이전 프로세스에서 중단된 running 작업을 다시 대기열에 넣습니다. 실행 중에도 대기열이 비면
+    db.JOB_STALE_SECONDS 동안 갱신이 없는 running 작업(다른 프로세스에서 멈춘 작업 등)을 다시 넣습니다.
+    """
+    with _start_lock:
+        if _threads:
+            return
+        db.requeue_stale_jobs(stale_seconds=0)
+        for i in range(num_threads):
+            thread = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            _threads.append(thread)
@@ -1,5 +1,7 @@
 import streamlit as st
 import db
+import job_worker
+import metrics
 from components import folder_management, chat_interface
 
 # 페이지 기본 설정
@@ -69,8 +71,24 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# DB 초기화 (최초 1회)
-db.initialize_db()
+@st.cache_resource
+def start_services():
+    """프로세스당 한 번만 실행되는 초기화. 이후 재실행(rerun)에서는 호출 자체를 건너뜁니다."""
+    # DB 스키마 마이그레이션
+    db.initialize_db()
+    # PDF 변환 등 백그라운드 작업 워커 시작
+    job_worker.start_worker()
+    # 성능 측정값 저장·내보내기 시작
+    metrics.start()
+
+
+start_services()
+
+# 관리자 성능 지표 화면 (?admin=metrics)
+if st.query_params.get("admin") == "metrics":
+    from components import metrics_dashboard
+    metrics_dashboard.render_metrics_dashboard()
+    st.stop()
 
 # 채팅 세션 초기화
 chat_interface.initialize_chat()
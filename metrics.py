@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 주요 작업(DB 함수, OpenAI 호출, PDF 변환)의 실행 시간과 크기를 기록하는 가벼운 계측 모듈
+#
+# 최근 기록은 링 버퍼에 보관하여 p50/p95를 계산하고, 누적 합계는 Prometheus 카운터로 내보냅니다.
+# 링 버퍼와 누적 합계는 주기적으로 METRICS_PATH에 저장되어 재시작 후에도 이어집니다.
+
+METRICS_PATH = os.path.join('data', 'metrics.json')
+RING_SIZE = 5000
+PERSIST_INTERVAL_SECONDS = 30.0
+PROMETHEUS_PREFIX = "docs_fairy"
+
+# 링 버퍼 항목의 필드 순서
+FIELDS = ("ts", "op", "duration_ms", "rows", "prompt_tokens", "completion_tokens", "payload_bytes", "error")
+_COUNTED = ("rows", "prompt_tokens", "completion_tokens", "payload_bytes")
+
+_samples = deque(maxlen=RING_SIZE)
+_totals = {}
+_lock = threading.Lock()
+_started = False
+_start_lock = threading.Lock()
+
+
+def record(op, duration_ms, rows=None, prompt_tokens=None, completion_tokens=None,
+           payload_bytes=None, error=False):
+    """작업 한 번의 측정값을 기록합니다."""
+    sample = (time.time(), op, duration_ms, rows, prompt_tokens, completion_tokens, payload_bytes, error)
+    with _lock:
+        _samples.append(sample)
+        total = _totals.get(op)
+        if total is None:
+            total = _totals[op] = {"count": 0, "errors": 0, "duration_ms": 0.0,
+                                   **{name: 0 for name in _COUNTED}}
+        total["count"] += 1
+        total["errors"] += bool(error)
+        total["duration_ms"] += duration_ms
+        for name, value in zip(_COUNTED, (rows, prompt_tokens, completion_tokens, payload_bytes)):
+            if value:
+                total[name] += value
+
+
+@contextmanager
+def span(op):
+    """블록의 실행 시간을 기록합니다. 돌려주는 딕셔너리에 rows, prompt_tokens 등을 채우면 함께 기록됩니다."""
+    fields = {}
+    start = time.perf_counter()
+    error = False
+    try:
+        yield fields
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(op, (time.perf_counter() - start) * 1000, error=error, **fields)
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    # (목록, 추가 정보) 형태의 반환값
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+
+def timed(op=None):
+    """함수의 실행 시간과 반환된 행 수(리스트 길이)를 기록하는 데코레이터."""
+    def decorator(fn):
+        name = op or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = None
+            error = False
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            except BaseException:
+                error = True
+                raise
+            finally:
+                record(name, (time.perf_counter() - start) * 1000, rows=_row_count(result), error=error)
+        return wrapper
+    return decorator
+
+
+def instrument_module(namespace, skip=()):
+    """모듈에 정의된 공개 함수를 모두 timed로 감쌉니다. (모듈 끝에서 globals()를 넘겨 호출)"""
+    module = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if (name.startswith('_') or name in skip or not callable(value) or isinstance(value, type)
+                or getattr(value, '__module__', None) != module):
+            continue
+        namespace[name] = timed(f"{module}.{name}")(value)
+
+
+# — 조회·내보내기 — #
+
+def get_samples():
+    """링 버퍼의 측정값을 딕셔너리 리스트로 반환합니다. (오래된 순)"""
+    with _lock:
+        samples = list(_samples)
+    return [dict(zip(FIELDS, s)) for s in samples]
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize():
+    """링 버퍼 기준 작업별 통계(p50/p95 등)를 호출 수가 많은 순으로 반환합니다."""
+    by_op = {}
+    for s in get_samples():
+        by_op.setdefault(s["op"], []).append(s)
+    rows = []
+    for op, samples in by_op.items():
+        durations = sorted(s["duration_ms"] for s in samples)
+        row = {
+            "op": op,
+            "count": len(samples),
+            "errors": sum(1 for s in samples if s["error"]),
+            "p50_ms": round(_percentile(durations, 0.5), 3),
+            "p95_ms": round(_percentile(durations, 0.95), 3),
+            "max_ms": round(durations[-1], 3),
+            "total_ms": round(sum(durations), 3),
+        }
+        for name in _COUNTED:
+            row[name] = sum(s[name] or 0 for s in samples)
+        rows.append(row)
+    rows.sort(key=lambda r: r["count"], reverse=True)
+    return rows
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """Prometheus 텍스트 형식으로 내보냅니다.
+
+    실행 시간은 링 버퍼 기준 분위수(summary)와 누적 합계·횟수, 그 외 값은 누적 카운터입니다.
+    """
+    with _lock:
+        totals = {op: dict(t) for op, t in _totals.items()}
+    quantiles = {r["op"]: r for r in summarize()}
+    p = PROMETHEUS_PREFIX
+    lines = [
+        f"# HELP {p}_operation_duration_seconds Operation latency (quantiles over the recent window).",
+        f"# TYPE {p}_operation_duration_seconds summary",
+    ]
+    for op in sorted(totals):
+        t = totals[op]
+        label = f'op="{_label(op)}"'
+        if op in quantiles:
+            for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms")):
+                lines.append(f'{p}_operation_duration_seconds{{{label},quantile="{q}"}} {quantiles[op][key] / 1000:.6f}')
+        lines.append(f"{p}_operation_duration_seconds_sum{{{label}}} {t['duration_ms'] / 1000:.6f}")
+        lines.append(f"{p}_operation_duration_seconds_count{{{label}}} {t['count']}")
+    counters = (
+        ("operation_errors_total", "Failed operations.", "errors", None),
+        ("operation_rows_total", "Rows returned by operations.", "rows", None),
+        ("llm_tokens_total", "LLM tokens used.", "prompt_tokens", 'kind="prompt"'),
+        ("llm_tokens_total", "LLM tokens used.", "completion_tokens", 'kind="completion"'),
+        ("operation_payload_bytes_total", "Payload bytes sent by operations.", "payload_bytes", None),
+    )
+    declared = set()
+    for metric, help_text, key, extra in counters:
+        if metric not in declared:
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} counter")
+            declared.add(metric)
+        for op in sorted(totals):
+            if totals[op][key] or key == "errors":
+                labels = f'op="{_label(op)}"' + (f",{extra}" if extra else "")
+                lines.append(f"{p}_{metric}{{{labels}}} {totals[op][key]}")
+    return "\n".join(lines) + "\n"
+
+
+# — 저장·시작 — #
+
+def persist(path=None):
+    """링 버퍼와 누적 합계를 파일에 저장합니다. (임시 파일에 쓴 뒤 교체)"""
+    path = path or METRICS_PATH
+    with _lock:
+        data = {"samples": list(_samples), "totals": {op: dict(t) for op, t in _totals.items()}}
+    data_dir = os.path.dirname(path)
+    if data_dir and not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load(path=None):
+    """저장된 측정값을 불러와 현재 기록 앞에 합칩니다."""
+    path = path or METRICS_PATH
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"측정값 파일을 읽지 못했습니다: {str(e)}")
+        return
+    with _lock:
+        current = list(_samples)
+        _samples.clear()
+        _samples.extend(tuple(s) for s in data.get("samples", []))
+        _samples.extend(current)
+        for op, saved in data.get("totals", {}).items():
+            total = _totals.setdefault(op, {key: 0 for key in saved})
+            for key, value in saved.items():
+                total[key] = total.get(key, 0) + value
+
+
+def _persist_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            persist()
+        except OSError as e:
+            print(f"측정값 저장 중 오류 발생: {str(e)}")
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(interval=PERSIST_INTERVAL_SECONDS):
+    """저장된 측정값을 불러오고 주기적 저장을 시작합니다. (프로세스당 한 번, 여러 번 호출해도 안전)
+
+    METRICS_PORT 환경 변수가 있으면 해당 포트의 /metrics에서 Prometheus 형식으로 내보냅니다.
+    """
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        load()
+        threading.Thread(target=_persist_loop, args=(interval,), name="metrics-persist", daemon=True).start()
+        atexit.register(persist)
+        port = os.environ.get("METRICS_PORT")
+        if port:
+            server = ThreadingHTTPServer(("0.0.0.0", int(port)), _ExportHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
@@ -1,36 +1,403 @@
 import os
+import re
+import sys
+import json
+import time
+import heapq
+import random
+import hashlib
+import itertools
+import threading
+import unicodedata
+from email.utils import parsedate_to_datetime
+import httpx
+import openai
 from dotenv import load_dotenv
 from openai import OpenAI
-import streamlit as st
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+import db
+import metrics
+import tokens
 
 # OpenAI API integration
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
 MODEL = "gpt-4o"
+TEMPERATURE = 0.7
+
+# HTTP 연결 풀 설정 (프로세스 전체에서 하나의 풀을 재사용)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+
+# 프로세스 전체의 OpenAI 호출 한도 (계정 등급에 맞게 환경 변수로 조정)
+RATE_LIMIT_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500))
+RATE_LIMIT_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 30000))
+# 요청 전에 토큰 한도에서 미리 떼어 두는 응답 토큰 추정치 (응답 후 실제 사용량으로 정산)
+COMPLETION_TOKENS_RESERVE = 1000
+# 429를 받았는데 Retry-After가 없을 때 모든 요청을 멈추는 시간
+RATE_LIMIT_PAUSE_SECONDS = 5.0
+# 일시적 오류의 재시도: 최대 시도 횟수와 지수 백오프(무작위 지터) 기준·상한
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_WAIT_SECONDS = 30.0
+# Retry-After를 따를 때 동시에 재시도가 몰리지 않도록 더하는 최대 지터
+RETRY_JITTER_SECONDS = 1.0
+
+# 대기 중인 요청은 우선순위 값이 작은 것부터 통과합니다. (대화 응답이 PDF 변환·요약보다 먼저)
+PRIORITY_CHAT = 0
+PRIORITY_BACKGROUND = 1
+_PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_BACKGROUND: "background"}
+
+# 재시도할 일시적 오류 (APITimeoutError는 APIConnectionError의 하위 클래스)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
 
 load_dotenv()
 
+_client = None
+_client_lock = threading.Lock()
+
+def _get_setting(name):
+    """설정값을 Streamlit secrets(앱 실행 중일 때) → 환경 변수 순서로 읽습니다.
+
+    streamlit이 이미 로드된 경우에만 secrets를 보므로 일반 스크립트·워커에서는 streamlit을 import하지 않습니다.
+    """
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            if name in st.secrets:
+                return st.secrets[name]
+        except Exception:
+            # secrets.toml이 없는 환경
+            pass
+    return os.environ.get(name)
+
 def get_openai_client():
-    """Initialize and return OpenAI client with API key"""
-    # Use the provided API key or get it from environment variables
-    os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    return OpenAI(api_key=openai_api_key)
-
-def get_ai_response(messages):
-    """Get a response from the OpenAI API"""
+    """프로세스 전체에서 공유하는 OpenAI 클라이언트를 반환합니다.
+
+    처음 호출할 때 한 번만 생성하며, keep-alive 연결 풀을 재사용하므로 호출마다 TLS 연결을 새로 맺지 않습니다.
+    OPENAI_BASE_URL을 설정하면 로컬 대체 서버 등 다른 엔드포인트를 사용합니다.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # 재시도는 call_openai가 속도 제한과 함께 처리하므로 SDK 자체 재시도는 끕니다.
+                _client = OpenAI(
+                    api_key=_get_setting("OPENAI_API_KEY"),
+                    base_url=_get_setting("OPENAI_BASE_URL") or None,
+                    timeout=HTTP_TIMEOUT,
+                    max_retries=0,
+                    http_client=httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS),
+                )
+    return _client
+
+def reset_openai_client():
+    """공유 클라이언트를 닫습니다. (API 키나 base URL을 바꾼 뒤 다음 호출에서 새로 생성)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+# — 요청 속도 제한·재시도 — #
+
+class _RateLimiter:
+    """요청 수와 토큰 수, 두 개의 토큰 버킷으로 분당 한도를 지킵니다.
+
+    기다리는 요청은 (우선순위, 도착 순서)로 줄을 서며 맨 앞 요청만 버킷에서 꺼내 갑니다.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.request_rate = self.request_capacity / 60.0
+        self.token_rate = self.token_capacity / 60.0
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    def acquire(self, token_count, priority):
+        """요청 1개와 token_count만큼의 토큰을 얻을 때까지 기다리고, 기다린 시간(초)을 반환합니다."""
+        token_count = min(token_count, self.token_capacity)
+        started = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._order))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = None
+                    if self._waiting[0] == ticket:
+                        delay = max(
+                            self.paused_until - now,
+                            (1 - self.requests) / self.request_rate,
+                            (token_count - self.tokens) / self.token_rate,
+                        )
+                        if delay <= 0:
+                            self.requests -= 1
+                            self.tokens -= token_count
+                            return now - started
+                    self._cond.wait(delay)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def settle(self, estimated, actual):
+        """미리 뗀 토큰 추정치를 실제 사용량으로 정산합니다."""
+        with self._cond:
+            # acquire가 한도로 줄여 뗀 만큼만 돌려줍니다.
+            self.tokens += min(estimated, self.token_capacity) - actual
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """429를 받았을 때 모든 요청을 seconds초 동안 멈춥니다."""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_limiter = _RateLimiter(RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE)
+
+def estimate_request_tokens(messages):
+    """요청에 쓸 토큰(입력 추정치 + 응답 예약분)을 반환합니다."""
+    return tokens.estimate_message_tokens(messages) + COMPLETION_TOKENS_RESERVE
+
+def _retry_after_seconds(error):
+    """오류 응답의 Retry-After(-ms) 헤더를 초 단위로 반환합니다. (없으면 None)"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+_backoff = wait_random_exponential(multiplier=RETRY_BASE_SECONDS, max=RETRY_MAX_WAIT_SECONDS)
+
+def _retry_wait(retry_state):
+    retry_after = _retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_WAIT_SECONDS) + random.uniform(0, RETRY_JITTER_SECONDS)
+    return _backoff(retry_state)
+
+def _record_retry(retry_state):
+    error = retry_state.outcome.exception()
+    print(f"OpenAI 요청 재시도 ({retry_state.attempt_number}회 실패, "
+          f"{retry_state.next_action.sleep:.1f}초 후): {type(error).__name__}")
+    metrics.record("openai.retry_wait", retry_state.next_action.sleep * 1000, error=True)
+
+def _usage_tokens(usage):
+    return (getattr(usage, "total_tokens", None)
+            or (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0))
+
+def _limited_call(request, estimated_tokens, priority):
+    waited = _limiter.acquire(estimated_tokens, priority)
+    metrics.record(f"openai.queue_wait.{_PRIORITY_NAMES.get(priority, priority)}", waited * 1000)
+    try:
+        response = request()
+    except openai.RateLimitError as e:
+        # 한 요청이 429를 받으면 다른 요청도 같은 한도에 걸리므로 함께 멈춥니다.
+        # 429도 입력 토큰은 한도에 잡힐 수 있으므로 응답 예약분만 돌려줍니다.
+        _limiter.pause(_retry_after_seconds(e) or RATE_LIMIT_PAUSE_SECONDS)
+        _limiter.settle(estimated_tokens, max(estimated_tokens - COMPLETION_TOKENS_RESERVE, 0))
+        raise
+    except Exception:
+        # 실패한 시도(5xx, 연결 오류, 시간 초과 등)는 토큰을 쓰지 않았으므로 예약을 모두 돌려줍니다.
+        # 그러지 않으면 재시도할 때마다 예약이 쌓여 다음 대화 요청이 오래 기다립니다.
+        _limiter.settle(estimated_tokens, 0)
+        raise
+    # 스트림은 응답을 다 읽어야 사용량을 알 수 있으므로 호출한 쪽에서 _settle_usage로 정산합니다.
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        _settle_usage(estimated_tokens, usage)
+    return response
+
+def _settle_usage(estimated_tokens, usage=None, used_tokens=None):
+    """미리 뗀 estimated_tokens를 실제 사용량(usage 또는 used_tokens)으로 정산합니다."""
+    _limiter.settle(estimated_tokens, _usage_tokens(usage) if usage is not None else used_tokens)
+
+def call_openai(request, estimated_tokens=0, priority=PRIORITY_CHAT):
+    """OpenAI 호출 request()를 공유 속도 제한을 거쳐 실행합니다.
+
+    일시적 오류(429, 연결 오류, 5xx)는 Retry-After를 따르거나 지터를 둔 지수 백오프로
+    RETRY_MAX_ATTEMPTS번까지 시도하며, 그래도 실패하면 마지막 예외를 그대로 발생시킵니다.
+
+    Args:
+        request: 인자 없이 호출하는 함수 (예: lambda: client.chat.completions.create(...))
+        estimated_tokens: 토큰 한도에서 미리 뗄 양 (estimate_request_tokens 참고)
+        priority: PRIORITY_CHAT 또는 PRIORITY_BACKGROUND
+    """
+    retrying = Retrying(
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        wait=_retry_wait,
+        stop=stop_after_attempt(RETRY_MAX_ATTEMPTS),
+        before_sleep=_record_retry,
+        reraise=True,
+    )
+    return retrying(_limited_call, request, estimated_tokens, priority)
+
+# — 응답 생성 — #
+
+_PAGE_LINK_RE = re.compile(r'page://(\d+)')
+_SPACE_RE = re.compile(r'\s+')
+
+def _response_cache_key(messages, temperature):
+    """
+    모델, temperature, 정규화한 메시지, 메시지가 참조하는 페이지의 본문 해시로 캐시 키를 만듭니다.
+
+    Returns:
+        (cache_key, 참조한 page_id 리스트)
+    """
+    page_ids = sorted({int(pid) for m in messages for pid in _PAGE_LINK_RE.findall(m["content"])})
+    key_source = json.dumps({
+        "model": MODEL,
+        "temperature": temperature,
+        "messages": [
+            [m["role"], _SPACE_RE.sub(" ", unicodedata.normalize("NFC", m["content"])).strip()]
+            for m in messages
+        ],
+        "pages": db.get_page_content_hashes(page_ids),
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest(), page_ids
+
+def _payload_bytes(messages):
+    return sum(len(m["content"].encode("utf-8")) for m in messages)
+
+def record_usage(fields, usage):
+    """응답의 토큰 사용량을 metrics.span 필드에 채웁니다. (Chat Completions·Responses API 모두 지원)"""
+    if usage is None:
+        return
+    fields["prompt_tokens"] = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None)
+    fields["completion_tokens"] = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None)
+
+def get_ai_response(messages, priority=PRIORITY_CHAT):
+    """Get a response from the OpenAI API (같은 요청은 DB 캐시에서 바로 반환)
+
+    재시도 후에도 실패하면 openai 예외를 발생시킵니다. (오류 문구를 응답처럼 돌려주지 않음)
+    """
+    cache_key, page_ids = _response_cache_key(messages, TEMPERATURE)
+    cached = db.get_cached_response(cache_key)
+    if cached is not None:
+        return cached
+
     client = get_openai_client()
 
+    with metrics.span("openai.get_ai_response") as fields:
+        fields["payload_bytes"] = _payload_bytes(messages)
+        response = call_openai(
+            lambda: client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+            ),
+            estimate_request_tokens(messages),
+            priority,
+        )
+        record_usage(fields, getattr(response, "usage", None))
+    text = response.choices[0].message.content
+    db.put_cached_response(cache_key, text, page_ids)
+    return text
+
+def stream_ai_response(messages, cancel_event=None, priority=PRIORITY_CHAT):
+    """
+    OpenAI 응답을 생성되는 대로 조각(delta) 단위로 yield합니다.
+
+    Args:
+        messages: 대화 메시지 리스트
+        cancel_event: (선택) threading.Event. 설정되면 스트림을 닫고 생성을 중단합니다.
+        priority: 속도 제한 대기열에서의 우선순위
+
+    제너레이터를 close()해도 HTTP 스트림을 닫아 서버 측 생성이 중단됩니다.
+    캐시에 있는 요청은 저장된 응답을 한 번에 yield하며, 끝까지 완료된 응답만 캐시에 저장합니다.
+    스트림 시작 전 오류는 call_openai가 재시도하고, 그래도 실패하거나 스트림 도중 끊기면 예외를 발생시킵니다.
+    """
+    cache_key, page_ids = _response_cache_key(messages, TEMPERATURE)
+    cached = db.get_cached_response(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    client = get_openai_client()
+    started = time.perf_counter()
+    estimated = estimate_request_tokens(messages)
+
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            temperature=0.7,
+        stream = call_openai(
+            lambda: client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                stream=True,
+                # 마지막 조각(choices 없음)에 토큰 사용량을 받아 속도 제한 정산과 지표에 씁니다.
+                stream_options={"include_usage": True},
+            ),
+            estimated,
+            priority,
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error getting AI response: {str(e)}"
+    except Exception:
+        metrics.record("openai.stream_ai_response", (time.perf_counter() - started) * 1000,
+                       payload_bytes=_payload_bytes(messages), error=True)
+        raise
+
+    parts = []
+    usage = None
+    completed = False
+    failed = False
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        else:
+            completed = True
+    except Exception:
+        failed = True
+        raise
+    finally:
+        stream.close()
+        if usage is not None:
+            _settle_usage(estimated, usage)
+        else:
+            # 취소·오류로 사용량 조각을 받지 못하면 입력과 받은 만큼의 출력 추정치로 정산합니다.
+            _settle_usage(estimated, used_tokens=tokens.estimate_message_tokens(messages)
+                         + tokens.estimate_tokens("".join(parts)))
+        # 첫 요청부터 스트림이 끝나거나 중단될 때까지의 시간
+        fields = {}
+        record_usage(fields, usage)
+        metrics.record("openai.stream_ai_response", (time.perf_counter() - started) * 1000,
+                       payload_bytes=_payload_bytes(messages), error=failed, **fields)
+    if completed:
+        db.put_cached_response(cache_key, "".join(parts), page_ids)
 
 def upload_file_to_openai(file_path):
     """
@@ -46,11 +413,12 @@ def upload_file_to_openai(file_path):
     
     try:
         with open(file_path, "rb") as file:
-            response = client.files.create(
-                file=file,
-                purpose="user_data"
-            )
-            return response.id
+            data = file.read()
+        response = call_openai(
+            lambda: client.files.create(file=(os.path.basename(file_path), data), purpose="user_data"),
+            priority=PRIORITY_BACKGROUND,
+        )
+        return response.id
     except Exception as e:
         raise Exception(f"파일 업로드 중 오류 발생: {str(e)}")
 
@@ -64,7 +432,7 @@ def delete_file_from_openai(file_id):
     client = get_openai_client()
     
     try:
-        client.files.delete(file_id=file_id)
+        call_openai(lambda: client.files.delete(file_id=file_id), priority=PRIORITY_BACKGROUND)
         return True
     except Exception as e:
         print(f"파일 삭제 중 오류 발생: {str(e)}")
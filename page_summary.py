@@ -0,0 +1,26 @@
+import openai_api
+
+# 채팅 프롬프트에 본문 대신 넣을 페이지 요약을 만듭니다. (job_worker의 page_summary 작업에서 호출)
+
+# 이보다 짧은 본문은 요약하지 않고 그대로 씁니다.
+SUMMARY_PASSTHROUGH_CHARS = 400
+# 요약에 보내는 본문 최대 길이 (앞부분 기준)
+SUMMARY_INPUT_MAX_CHARS = 12000
+
+PAGE_SUMMARY_PROMPT = (
+    "당신은 업무 문서를 색인하는 비서입니다. 주어진 문서를 다른 문서와 함께 검색 결과로 보여줄 수 있도록 "
+    "핵심만 요약하십시오. 문서의 종류와 주제, 날짜, 결정 사항, 담당자, 수치, 정부지원사업 등 사업·과제 이름은 "
+    "반드시 보존하고, 한국어 개조식으로 5줄, 300자 이내로 작성하십시오."
+)
+
+
+def summarize_page(page_name, content):
+    """페이지 본문의 요약을 반환합니다. 짧은 본문은 그대로 반환하며, 요약에 실패하면 openai 예외를 발생시킵니다."""
+    content = (content or "").strip()
+    if len(content) <= SUMMARY_PASSTHROUGH_CHARS:
+        return content
+    # 백그라운드 작업이므로 대화 응답보다 뒤에 속도 제한을 통과합니다.
+    return openai_api.get_ai_response([
+        {"role": "system", "content": PAGE_SUMMARY_PROMPT},
+        {"role": "user", "content": f"[제목] {page_name}\n\n{content[:SUMMARY_INPUT_MAX_CHARS]}"},
+    ], priority=openai_api.PRIORITY_BACKGROUND)
@@ -1,29 +1,30 @@
-import os
-import base64
-import tempfile
-from openai_api import get_openai_client, MODEL
+import io
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import pikepdf
+from openai_api import (
+    get_openai_client, record_usage, call_openai, estimate_request_tokens,
+    MODEL, COMPLETION_TOKENS_RESERVE, PRIORITY_BACKGROUND,
+)
+import db
+import metrics
 
-def process_pdf_to_meeting_notes(uploaded_file, docs_type):
-    """
-    업로드된 PDF 파일을 처리하여 OpenAI API를 통해 회의록 형식으로 변환합니다.
-    (상세 프롬프트 및 responses.create 엔드포인트 사용)
-    
-    Args:
-        uploaded_file: Streamlit의 업로드된 파일 객체
-        
-    Returns:
-        회의록 형식의 텍스트
-    """
-    client = get_openai_client()
-    
-    # 상세 프롬프트 템플릿 (한국어, 회의록 전문가 역할 부여)
-    prompt_text = ""
-    if docs_type == "문서":
-        prompt_text = f"""
+# 텍스트 레이어를 페이지 구간으로 나눠 요약할 때 구간당 최대 글자 수와 동시 요약 수
+MAP_CHUNK_CHARS = 12000
+MAP_MAX_WORKERS = 8
+# 페이지당 평균 글자 수가 이보다 적으면 스캔본으로 보고 PDF를 그대로 업로드합니다.
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 30
+
+# 업로드한 원격 파일 삭제는 결과 반환을 막지 않도록 별도 스레드에서 처리합니다.
+_cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf-cleanup")
+
+# 상세 프롬프트 템플릿 (한국어, 회의록 전문가 역할 부여)
+DOCUMENT_PROMPT = """
 당신은 제공된 PDF 문서의 분석하여 가능한 한 원문의 내용을 유지하여 기술하는 문서 작성 전문가이다. 문서에 기재된 내용을 충실히 반영하되, 가독성을 위해 문단 구분이나 리스트 표시는 허용된다. 추가 해석이나 삭제은 하지말고, 마크다운을 사용해서 표시하라.
 """
-    else:
-        prompt_text = f"""
+
+MEETING_NOTES_PROMPT = """
 당신은 제공된 PDF 문서의 핵심 정보를 전문적인 회의록 형식으로 요약하는 임무를 맡은 숙련된 회의록 작성 전문가입니다.
 
 문서를 분석하여 다음 정보를 추출하고, 마크다운을 사용하여 명확하게 구조화해주세요:
@@ -38,63 +39,322 @@ def process_pdf_to_meeting_notes(uploaded_file, docs_type):
 
 요약은 간결하고 정확하며 전문적인 어조로 작성되어야 합니다. 문서에 제시된 사실적 정보 추출에 집중해주세요.
 """
-    
-    # 임시 파일로 저장
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(uploaded_file.getbuffer())
-        tmp_file_path = tmp_file.name
-    
+
+# 긴 문서를 페이지 구간별로 나눠 처리할 때의 map 단계 프롬프트
+DOCUMENT_MAP_PROMPT = DOCUMENT_PROMPT + """
+지금 제공되는 텍스트는 전체 문서 중 {start}~{end}페이지 구간이다. 이 구간만 변환하고, 문서 전체에 대한 머리말이나 맺음말은 덧붙이지 마라.
+"""
+
+MEETING_NOTES_MAP_PROMPT = """
+당신은 긴 PDF 문서의 {start}~{end}페이지 구간 텍스트를 읽고, 이후 하나의 회의록으로 합칠 수 있도록 사실 정보를 추출하는 전문가입니다.
+회의 주제, 날짜 및 시간, 참석자, 핵심 논의 사항, 결정된 사항, 실행 항목(담당자·마감일 포함), 다음 단계에 해당하는 내용을
+구간에 나온 그대로 빠짐없이 개조식으로 정리해주세요. 해당 내용이 없는 항목은 생략하고, 추측하지 마세요.
+"""
+
+# reduce 단계: 구간별 추출 내용을 회의록 프롬프트 형식으로 합칩니다.
+REDUCE_SUFFIX = """
+입력은 PDF 원문 대신 문서를 페이지 구간별로 나누어 추출한 내용입니다. 구간 간 중복은 합치고, 충돌하는 정보는 뒤쪽 페이지 기준으로 정리해주세요.
+"""
+
+# 프롬프트 문구가 바뀌면 버전이 바뀌어 이전 변환 캐시가 자동으로 무효화됩니다.
+PROMPT_VERSION = hashlib.sha256("".join((
+    DOCUMENT_PROMPT, MEETING_NOTES_PROMPT, DOCUMENT_MAP_PROMPT, MEETING_NOTES_MAP_PROMPT, REDUCE_SUFFIX
+)).encode("utf-8")).hexdigest()[:16]
+
+def get_prompt_template(docs_type):
+    """문서 유형에 맞는 변환 프롬프트를 반환합니다."""
+    return DOCUMENT_PROMPT if docs_type == "문서" else MEETING_NOTES_PROMPT
+
+def _delete_remote_file(client, file_id):
+    try:
+        call_openai(lambda: client.files.delete(file_id=file_id), priority=PRIORITY_BACKGROUND)
+        print(f"OpenAI 파일 삭제 완료: {file_id}")
+    except Exception as delete_e:
+        print(f"파일 삭제 중 오류 발생: {str(delete_e)}")
+
+def convert_pdf_bytes(data, docs_type, filename="upload.pdf"):
+    """
+    PDF 바이트를 회의록/문서 형식의 텍스트로 변환합니다. 실패하면 예외를 발생시킵니다.
+
+    텍스트 레이어가 있으면 로컬에서 추출하여 페이지 구간별로 병렬 요약한 뒤 합치고,
+    스캔본처럼 텍스트가 없으면 PDF를 그대로 업로드하여 변환합니다.
+    같은 PDF 바이트·문서 유형·모델·프롬프트 버전의 변환 결과는 DB에 저장해 두고,
+    다시 요청되면 원격 호출 없이 바로 반환합니다.
+    """
+    with metrics.span("pdf.convert_pdf_bytes") as fields:
+        fields["payload_bytes"] = len(data)
+        return _convert_pdf_bytes(data, docs_type, filename)
+
+def _convert_pdf_bytes(data, docs_type, filename):
+    cache_key = (hashlib.sha256(data).hexdigest(), docs_type, MODEL, PROMPT_VERSION)
+    cached = db.get_pdf_conversion(*cache_key)
+    if cached is not None:
+        print(f"PDF 변환 캐시 사용: {filename}")
+        return cached
+
+    try:
+        pages = extract_pdf_text(data)
+    except Exception as e:
+        print(f"PDF 텍스트 추출 실패, 파일 업로드로 변환합니다 ({filename}): {str(e)}")
+        pages = []
+
+    if has_text_layer(pages):
+        meeting_notes = _convert_text_pages(pages, docs_type)
+    else:
+        meeting_notes = _convert_with_file_upload(data, docs_type, filename)
+    db.save_pdf_conversion(*cache_key, meeting_notes)
+    return meeting_notes
+
+# — 텍스트 레이어 기반 map-reduce 변환 — #
+
+def _complete(system_prompt, user_text):
+    client = get_openai_client()
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_text},
+    ]
+    with metrics.span("openai.pdf_complete") as fields:
+        fields["payload_bytes"] = len(system_prompt.encode("utf-8")) + len(user_text.encode("utf-8"))
+        # PDF 변환은 백그라운드 작업이므로 대화 응답보다 뒤에 속도 제한을 통과합니다.
+        response = call_openai(
+            lambda: client.chat.completions.create(model=MODEL, messages=messages),
+            estimate_request_tokens(messages),
+            PRIORITY_BACKGROUND,
+        )
+        record_usage(fields, getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+def split_page_ranges(pages, max_chars=MAP_CHUNK_CHARS):
+    """페이지 텍스트를 max_chars 안팎의 연속 페이지 구간으로 묶습니다.
+
+    Returns:
+        [(시작 페이지, 끝 페이지, 구간 텍스트)] (페이지 번호는 1부터)
+    """
+    ranges = []
+    start, buf, size = 1, [], 0
+    for number, text in enumerate(pages, start=1):
+        if buf and size + len(text) > max_chars:
+            ranges.append((start, number - 1, "\n\n".join(buf)))
+            start, buf, size = number, [], 0
+        buf.append(f"[{number}페이지]\n{text.strip()}")
+        size += len(text)
+    if buf:
+        ranges.append((start, len(pages), "\n\n".join(buf)))
+    return ranges
+
+def _convert_text_pages(pages, docs_type):
+    """추출한 텍스트를 구간별로 동시에 변환(map)하고 하나의 결과로 합칩니다(reduce).
+
+    전체 지연 시간은 페이지 수가 아니라 가장 느린 구간 + (회의록의 경우) 합치기 1회에 비례합니다.
+    """
+    ranges = split_page_ranges(pages)
+    if len(ranges) == 1:
+        return _complete(get_prompt_template(docs_type), ranges[0][2])
+
+    map_prompt = DOCUMENT_MAP_PROMPT if docs_type == "문서" else MEETING_NOTES_MAP_PROMPT
+    with ThreadPoolExecutor(max_workers=min(MAP_MAX_WORKERS, len(ranges)), thread_name_prefix="pdf-map") as pool:
+        partials = list(pool.map(
+            lambda r: _complete(map_prompt.format(start=r[0], end=r[1]), r[2]),
+            ranges
+        ))
+
+    if docs_type == "문서":
+        # 원문 유지가 목적이므로 구간 결과를 순서대로 이어 붙입니다.
+        return "\n\n".join(partials)
+    merged = "\n\n".join(
+        f"### {start}~{end}페이지 추출 내용\n{text}" for (start, end, _), text in zip(ranges, partials)
+    )
+    return _complete(MEETING_NOTES_PROMPT + REDUCE_SUFFIX, merged)
+
+def _convert_with_file_upload(data, docs_type, filename):
+    """텍스트 레이어가 없는 PDF를 OpenAI에 업로드하여 변환합니다. (임시 파일 없이 메모리에서 업로드)"""
+    client = get_openai_client()
+    prompt_text = get_prompt_template(docs_type)
+
     file_id = None # file_id 초기화
     try:
         # 1. 파일 업로드
-        file_response = client.files.create(
-            file=open(tmp_file_path, "rb"),
-            purpose="user_data"
+        file_response = call_openai(
+            lambda: client.files.create(file=(filename, data, "application/pdf"), purpose="user_data"),
+            priority=PRIORITY_BACKGROUND,
         )
         file_id = file_response.id
-        print(f"OpenAI 파일 업로드 완료: {file_id}")
+        print(f"OpenAI 파일 업로드 완료: {file_id} ({filename})")
         
         # 2. API 호출 (responses.create 사용)
         # 참고: responses.create 엔드포인트는 현재 베타이거나 특정 모델에만 적용될 수 있습니다.
         # 공식 문서상 모델이 gpt-4.1로 되어있으나, 현재 사용 가능한 최신 모델(gpt-4o 등)로 시도합니다.
-        response = client.responses.create(
-            model=MODEL, # 또는 "gpt-4-turbo", "gpt-4o" 등 파일 입력 지원 모델
-            input=[
-                {
-                    "role": "user", 
-                    "content": [
-                        {
-                            "type": "input_file", 
-                            "file_id": file_id
-                        },
-                        {
-                            "type": "input_text",
-                            "text": prompt_text
-                        }
-                    ]
-                }
-            ]
-        )
+        with metrics.span("openai.pdf_file_response") as fields:
+            fields["payload_bytes"] = len(data)
+            # 파일 입력의 토큰 수는 미리 알 수 없으므로 응답 예약분만 떼고 실제 사용량으로 정산합니다.
+            response = call_openai(lambda: client.responses.create(
+                model=MODEL, # 또는 "gpt-4-turbo", "gpt-4o" 등 파일 입력 지원 모델
+                input=[
+                    {
+                        "role": "user", 
+                        "content": [
+                            {
+                                "type": "input_file", 
+                                "file_id": file_id
+                            },
+                            {
+                                "type": "input_text",
+                                "text": prompt_text
+                            }
+                        ]
+                    }
+                ]
+            ), COMPLETION_TOKENS_RESERVE, PRIORITY_BACKGROUND)
+            record_usage(fields, getattr(response, "usage", None))
         
         # 결과 추출
-        meeting_notes = response.output_text # 예제에 따라 output_text 사용
-        
-        return meeting_notes
-        
-    except Exception as e:
-        error_message = f"PDF 처리 중 오류가 발생했습니다: {str(e)}"
-        print(error_message)
-        return error_message
+        return response.output_text # 예제에 따라 output_text 사용
         
     finally:
-        # 임시 파일 삭제
-        if os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
-            print(f"임시 파일 삭제 완료: {tmp_file_path}")
-        # OpenAI 파일 삭제 (오류 발생 여부와 관계없이 시도)
+        # OpenAI 파일 삭제 (오류 발생 여부와 관계없이 시도, 결과 반환을 기다리게 하지 않음)
         if file_id:
+            _cleanup_executor.submit(_delete_remote_file, client, file_id)
+
+# — PDF 텍스트 레이어 추출 (pikepdf) — #
+
+def extract_pdf_text(data):
+    """PDF 바이트에서 텍스트 레이어를 페이지별 문자열 리스트로 추출합니다.
+
+    pikepdf로 콘텐츠 스트림의 텍스트 연산자(Tj, TJ, ', ")를 해석하고,
+    폰트의 ToUnicode CMap으로 글자 코드를 유니코드로 바꿉니다. (한글 CID 폰트 포함)
+    """
+    pages = []
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        for page in pdf.pages:
+            out = []
             try:
-                client.files.delete(file_id=file_id)
-                print(f"OpenAI 파일 삭제 완료: {file_id}")
-            except Exception as delete_e:
-                print(f"파일 삭제 중 오류 발생: {str(delete_e)}") 
\ No newline at end of file
+                _walk_content(page, _page_resources(page), out, depth=0)
+            except Exception as e:
+                print(f"페이지 텍스트 추출 실패: {str(e)}")
+            pages.append(_clean_text("".join(out)))
+    return pages
+
+def has_text_layer(pages):
+    """추출한 텍스트가 요약에 쓸 만큼 충분한지 판단합니다. (스캔본이면 False)"""
+    if not pages:
+        return False
+    text = "".join(pages)
+    visible = len(text) - text.count(" ") - text.count("\n")
+    if visible < TEXT_LAYER_MIN_CHARS_PER_PAGE * len(pages):
+        return False
+    return text.count("\ufffd") <= visible * 0.05
+
+def _page_resources(page):
+    try:
+        return page.resources
+    except Exception:
+        return page.obj.get("/Resources") or pikepdf.Dictionary()
+
+def _walk_content(owner, resources, out, depth):
+    fonts = resources.get("/Font") or pikepdf.Dictionary()
+    xobjects = resources.get("/XObject") or pikepdf.Dictionary()
+    decoders = {}
+    decode = _make_font_decoder(None)
+    last_y = None
+    for operands, operator in pikepdf.parse_content_stream(owner):
+        op = str(operator)
+        if op == "Tf":
+            name = str(operands[0])
+            if name not in decoders:
+                decoders[name] = _make_font_decoder(fonts.get(name))
+            decode = decoders[name]
+        elif op == "Tj":
+            out.append(decode(operands[0]))
+        elif op in ("'", '"'):
+            out.append("\n" + decode(operands[-1]))
+        elif op == "TJ":
+            for item in operands[0]:
+                if isinstance(item, pikepdf.String):
+                    out.append(decode(item))
+                elif float(item) < -200:
+                    # 글자 간격이 크게 벌어지면 띄어쓰기로 봅니다.
+                    out.append(" ")
+        elif op in ("Td", "TD"):
+            if float(operands[1]) != 0:
+                out.append("\n")
+        elif op == "Tm":
+            y = float(operands[5])
+            if last_y is not None and y != last_y:
+                out.append("\n")
+            last_y = y
+        elif op == "T*":
+            out.append("\n")
+        elif op == "Do" and depth < 3:
+            xobj = xobjects.get(str(operands[0]))
+            if xobj is not None and xobj.get("/Subtype") == "/Form":
+                _walk_content(xobj, xobj.get("/Resources") or resources, out, depth + 1)
+
+def _make_font_decoder(font):
+    """폰트 사전에 맞는 (PDF 문자열 → 유니코드) 변환 함수를 만듭니다."""
+    mapping, widths = {}, []
+    is_type0 = font is not None and font.get("/Subtype") == "/Type0"
+    to_unicode = font.get("/ToUnicode") if font is not None else None
+    if isinstance(to_unicode, pikepdf.Stream):
+        mapping, widths = _parse_to_unicode_cmap(to_unicode.read_bytes())
+    widths = sorted(widths) or ([2] if is_type0 else [1])
+
+    def decode(string):
+        raw = bytes(string)
+        if not mapping:
+            # ToUnicode가 없는 단순 폰트는 PDFDocEncoding으로, CID 폰트는 해석할 수 없어 건너뜁니다.
+            return "" if is_type0 else str(string)
+        chars = []
+        i = 0
+        while i < len(raw):
+            for w in widths:
+                code = raw[i:i + w]
+                if code in mapping:
+                    chars.append(mapping[code])
+                    i += w
+                    break
+            else:
+                i += widths[-1]
+        return "".join(chars)
+
+    return decode
+
+_CMAP_BLOCK_RE = re.compile(rb'begin(codespacerange|bfchar|bfrange)(.*?)end\1', re.S)
+_CMAP_PAIR_RE = re.compile(rb'<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>')
+_CMAP_RANGE_RE = re.compile(rb'<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(<[0-9A-Fa-f]*>|\[[^\]]*\])')
+_CMAP_HEX_RE = re.compile(rb'<([0-9A-Fa-f]*)>')
+
+def _utf16(hex_bytes):
+    return bytes.fromhex(hex_bytes.decode("ascii")).decode("utf-16-be", errors="replace")
+
+def _parse_to_unicode_cmap(cmap):
+    """ToUnicode CMap 스트림을 {글자 코드 바이트: 유니코드 문자열}과 코드 길이 집합으로 해석합니다."""
+    mapping = {}
+    widths = set()
+    for kind, body in _CMAP_BLOCK_RE.findall(cmap):
+        if kind == b"codespacerange":
+            widths.update(len(lo) // 2 for lo, _ in _CMAP_PAIR_RE.findall(body))
+        elif kind == b"bfchar":
+            for src, dst in _CMAP_PAIR_RE.findall(body):
+                mapping[bytes.fromhex(src.decode("ascii"))] = _utf16(dst)
+        else:
+            for m in _CMAP_RANGE_RE.finditer(body):
+                lo, hi, width = int(m[1], 16), int(m[2], 16), len(m[1]) // 2
+                if m[3].startswith(b"["):
+                    for k, dst in enumerate(_CMAP_HEX_RE.findall(m[3])):
+                        mapping[(lo + k).to_bytes(width, "big")] = _utf16(dst)
+                    continue
+                base_hex = m[3][1:-1]
+                base, dst_len = int(base_hex or b"0", 16), max(len(base_hex) // 2, 2)
+                for k in range(min(hi - lo, 0xFFFF) + 1):
+                    mapping[(lo + k).to_bytes(width, "big")] = (
+                        (base + k).to_bytes(dst_len, "big").decode("utf-16-be", errors="replace")
+                    )
+    return mapping, widths
+
+_BLANK_RUN_RE = re.compile(r'[ \t]+')
+_NEWLINE_RUN_RE = re.compile(r'\n{3,}')
+
+def _clean_text(text):
+    text = _BLANK_RUN_RE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _NEWLINE_RUN_RE.sub("\n\n", text).strip()
@@ -0,0 +1,36 @@
+import re
+
+# 토크나이저 없이 쓰는 토큰 수 추정과 요청당 토큰 예산 설정
+
+# 요청 1회에 보낼 최대 입력 토큰 (응답 생성 여유분은 제외한 값)
+REQUEST_TOKEN_BUDGET = 12000
+# 지시문을 뺀 나머지 중 검색 문서가 쓸 수 있는 최대 비율. 남는 예산은 대화 기록이 사용합니다.
+DOCS_BUDGET_RATIO = 0.6
+# 문서 예산 중 상위 몇 페이지를 제외한 나머지 관련 페이지의 요약에 쓸 수 있는 비율
+SUMMARIES_BUDGET_RATIO = 0.3
+# 문서 예산 중 검색된 페이지의 최근 수정 내용(diff)에 쓸 수 있는 비율
+CHANGES_BUDGET_RATIO = 0.15
+# 메시지마다 role/구분자 등으로 붙는 토큰
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_HANGUL_RE = re.compile(r'[가-힣]')
+
+
+def estimate_tokens(text):
+    """토큰 수를 대략 추정합니다. (한글 1자 ≈ 1토큰, 그 외 4자 ≈ 1토큰)"""
+    if not text:
+        return 0
+    hangul = len(_HANGUL_RE.findall(text))
+    return hangul + (len(text) - hangul) // 4 + 1
+
+
+def estimate_message_tokens(messages):
+    """채팅 메시지 리스트의 토큰 수를 추정합니다."""
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def split_budget(instruction_tokens, total=REQUEST_TOKEN_BUDGET, docs_ratio=DOCS_BUDGET_RATIO):
+    """지시문을 제외한 예산을 (문서 예산, 대화 기록 최소 예산)으로 나눕니다."""
+    available = max(total - instruction_tokens, 0)
+    docs = int(available * docs_ratio)
+    return docs, available - docs
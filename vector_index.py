@@ -0,0 +1,264 @@
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# 페이지 조각 임베딩을 DB 파일 옆에 float32 행렬로 저장하는 로컬 벡터 인덱스
+
+_WORD_RE = re.compile(r'\w+')
+
+
+class HashingEmbedder:
+    """문자 n-gram을 해싱하여 고정 차원 벡터로 만드는 오프라인 임베더.
+
+    네트워크 없이 동작하며, 조사가 붙거나 어순이 바뀐 한국어 문장도
+    음절 n-gram이 겹치면 가까운 벡터가 됩니다.
+    """
+
+    def __init__(self, dim=1024, ngram_range=(1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.name = f"hashing-{dim}-{ngram_range[0]}-{ngram_range[1]}"
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        lo, hi = self.ngram_range
+        for row, text in enumerate(texts):
+            for word in _WORD_RE.findall((text or "").lower()):
+                padded = f" {word} "
+                for n in range(lo, hi + 1):
+                    for i in range(len(padded) - n + 1):
+                        gram = padded[i:i + n]
+                        if gram.isspace():
+                            continue
+                        h = zlib.crc32(gram.encode("utf-8"))
+                        out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(out)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+_default_embedder = HashingEmbedder()
+
+
+def get_default_embedder():
+    return _default_embedder
+
+
+def set_default_embedder(embedder):
+    """기본 임베더를 교체합니다. (name, dim 속성과 embed(texts) 메서드 필요)
+
+    저장된 인덱스와 임베더 이름이 다르면 인덱스는 비워지고 다시 색인됩니다.
+    """
+    global _default_embedder
+    _default_embedder = embedder
+
+
+class VectorIndex:
+    """조각 임베딩 행렬과 (chunk_id, page_id) 목록을 파일로 관리합니다.
+
+    - <base>.f32 : 행 단위 float32 임베딩 (읽기 시 memory-map)
+    - <base>.ids : 행 단위 int64 (chunk_id, page_id), 삭제된 행은 page_id = -1
+    - <base>.json: 임베더 이름, 차원, 행 수 등 메타데이터
+    """
+
+    COMPACT_MIN_DEAD = 1024
+
+    def __init__(self, base_path, embedder=None):
+        self.embedder = embedder or get_default_embedder()
+        self.vec_path = base_path + ".f32"
+        self.ids_path = base_path + ".ids"
+        self.meta_path = base_path + ".json"
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._page_rows = None
+        self._load()
+
+    # — 파일 입출력 — #
+
+    def _load(self):
+        meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        if (
+            not meta
+            or meta.get("embedder") != self.embedder.name
+            or meta.get("dim") != self.embedder.dim
+            or not self._files_hold(meta["rows"])
+        ):
+            self.reset()
+            return
+        rows = meta["rows"]
+        # 마지막 쓰기가 중간에 끊겼다면 메타데이터의 행 수에 맞춰 잘라냅니다.
+        self._truncate(rows)
+        self._ids = np.fromfile(self.ids_path, dtype=np.int64).reshape(rows, 2)
+        self._matrix = None
+        self._page_rows = None
+
+    def _files_hold(self, rows):
+        dim = self.embedder.dim
+        return (
+            os.path.exists(self.vec_path)
+            and os.path.exists(self.ids_path)
+            and os.path.getsize(self.vec_path) >= rows * dim * 4
+            and os.path.getsize(self.ids_path) >= rows * 16
+        )
+
+    def _truncate(self, rows):
+        for path, size in ((self.vec_path, rows * self.embedder.dim * 4), (self.ids_path, rows * 16)):
+            if os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _replace_file(self, path, array):
+        # 제자리에서 다시 쓰거나 자르면 다른 스레드가 검색 중인 memmap이 잘린 파일을 읽어 SIGBUS가 나므로,
+        # 임시 파일에 쓴 뒤 교체합니다. 기존 memmap은 이전 파일(inode)을 계속 봅니다.
+        tmp = path + ".tmp"
+        array.tofile(tmp)
+        os.replace(tmp, path)
+
+    def _rows_for_pages(self, page_ids):
+        """page_ids 페이지들의 행 번호를 오름차순으로 반환합니다. (page_id로 정렬한 행 순서를 캐시하여 이진 탐색)"""
+        if self._page_rows is None:
+            order = np.argsort(self._ids[:, 1], kind="stable")
+            self._page_rows = (self._ids[order, 1], order)
+        pages, order = self._page_rows
+        wanted = np.unique(np.asarray(list(page_ids), dtype=np.int64))
+        lo = np.searchsorted(pages, wanted, "left")
+        counts = np.searchsorted(pages, wanted, "right") - lo
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.sort(order[np.repeat(lo, counts) + offsets])
+
+    def _write_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "rows": len(self._ids),
+            }, f)
+        os.replace(tmp, self.meta_path)
+
+    def _matrix_view(self):
+        if self._matrix is None and len(self._ids):
+            self._matrix = np.memmap(
+                self.vec_path, dtype=np.float32, mode="r",
+                shape=(len(self._ids), self.embedder.dim)
+            )
+        return self._matrix
+
+    # — 공개 API — #
+
+    def __len__(self):
+        return int((self._ids[:, 1] >= 0).sum())
+
+    def fingerprint(self):
+        """살아 있는 행의 (개수, 최대 chunk_id, chunk_id 합계). DB의 page_chunks와 비교해 누락된 갱신을 찾습니다."""
+        with self._lock:
+            live = self._ids[self._ids[:, 1] >= 0, 0]
+        return (len(live), int(live.max()) if len(live) else 0, float(live.sum()))
+
+    def reset(self):
+        """인덱스를 비웁니다."""
+        with self._lock:
+            self._matrix = None
+            self._page_rows = None
+            self._ids = np.zeros((0, 2), dtype=np.int64)
+            self._replace_file(self.vec_path, np.zeros((0, self.embedder.dim), dtype=np.float32))
+            self._replace_file(self.ids_path, self._ids)
+            self._write_meta()
+
+    def add(self, chunk_ids, page_ids, texts):
+        """새 조각을 임베딩하여 파일 끝에 추가합니다."""
+        if not texts:
+            return
+        vectors = self._embed(texts)
+        with self._lock:
+            self._append(vectors, chunk_ids, page_ids)
+
+    def replace_pages(self, page_ids, chunk_ids, chunk_page_ids, texts):
+        """page_ids 페이지들의 행을 새 조각으로 교체합니다.
+
+        임베딩을 먼저 계산한 뒤 삭제와 추가를 한 번에 하므로, 검색에서 페이지가 잠시 빠지는 일이 없습니다.
+        """
+        vectors = self._embed(texts) if texts else None
+        with self._lock:
+            self.remove_pages(page_ids)
+            if vectors is not None:
+                self._append(vectors, chunk_ids, chunk_page_ids)
+
+    def _embed(self, texts):
+        return np.ascontiguousarray(self.embedder.embed(texts), dtype=np.float32)
+
+    def _append(self, vectors, chunk_ids, page_ids):
+        ids = np.column_stack([chunk_ids, page_ids]).astype(np.int64)
+        with open(self.vec_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(ids.tobytes())
+        self._ids = np.concatenate([self._ids, ids])
+        self._matrix = None
+        self._page_rows = None
+        self._write_meta()
+
+    def remove_pages(self, page_ids):
+        """페이지에 속한 행을 삭제 표시하고, 삭제된 행이 많으면 압축합니다."""
+        with self._lock:
+            if not len(self._ids):
+                return
+            dead = np.isin(self._ids[:, 1], list(page_ids))
+            if not dead.any():
+                return
+            self._ids[dead, 1] = -1
+            self._page_rows = None
+            self._ids.tofile(self.ids_path)
+            dead_total = int((self._ids[:, 1] < 0).sum())
+            if dead_total >= max(self.COMPACT_MIN_DEAD, len(self._ids) // 2):
+                self.compact()
+
+    def compact(self):
+        """삭제 표시된 행을 제거하여 파일을 다시 씁니다."""
+        with self._lock:
+            live = self._ids[:, 1] >= 0
+            matrix = self._matrix_view()
+            vectors = np.array(matrix[live]) if matrix is not None else np.zeros((0, self.embedder.dim), np.float32)
+            self._matrix = None
+            self._page_rows = None
+            self._ids = np.ascontiguousarray(self._ids[live])
+            self._replace_file(self.vec_path, vectors)
+            self._replace_file(self.ids_path, self._ids)
+            self._write_meta()
+
+    def search(self, query, k, page_ids=None):
+        """질문과 코사인 유사도가 높은 조각 k개를 (chunk_id, page_id, score) 리스트로 반환합니다.
+
+        page_ids를 주면 그 페이지들의 행만 읽어 점수를 계산합니다. (범위 밖 행은 읽지 않음)
+        """
+        with self._lock:
+            matrix = self._matrix_view()
+            ids = self._ids
+            rows = self._rows_for_pages(page_ids) if page_ids is not None and matrix is not None else None
+        if matrix is None or k <= 0:
+            return []
+        q = self.embedder.embed([query])[0]
+        if rows is not None:
+            if not len(rows):
+                return []
+            matrix, ids = matrix[rows], ids[rows]
+        scores = matrix @ q
+        scores[ids[:, 1] < 0] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(ids[i, 0]), int(ids[i, 1]), float(scores[i]))
+            for i in top if np.isfinite(scores[i]) and scores[i] > 0
+        ]